@@ -1,4 +1,5 @@
 import os
+import threading
 from multiprocessing import AuthenticationError
 
 import deepl
@@ -9,6 +10,7 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from httplib2 import Authentication
 from pydantic import PrivateAttr
+from requests.adapters import HTTPAdapter
 
 # load enviorment variables
 load_dotenv()
@@ -39,26 +41,50 @@ def google_auth(api_key: str):
 class Singleton(type):
     def __init__(self, *args, **kwargs):
         self.__instance = None
+        self.__lock = threading.Lock()
         super().__init__(*args, **kwargs)
 
     def __call__(self, *args, **kwargs):
         if self.__instance is None:
-            self.__instance = super().__call__(*args, **kwargs)
-            return self.__instance
-        else:
-            return self.__instance
-
-
-class DEEPL_AUTH:
-    """DEEPL API Authentication Class"""
+            # only one thread may create the instance, the others wait for it
+            with self.__lock:
+                if self.__instance is None:
+                    self.__instance = super().__call__(*args, **kwargs)
+        return self.__instance
+
+
+class DEEPL_AUTH(metaclass=Singleton):
+    """DEEPL API Authentication Class. This class is a singleton, the translator and its pooled HTTP connections are shared by the whole process.
+
+    Environment:
+        DEEPL_API_KEY: the DeepL auth key
+        DEEPL_SERVER_URL: overrides the DeepL server, i.e. a local stand-in
+        DEEPL_POOL_SIZE: number of kept-alive connections to DeepL
+        DEEPL_TIMEOUT: connection timeout in seconds
+        DEEPL_MAX_RETRIES: number of retries of a failed request
+    """
 
     def __init__(self):
         self.deeplApiKey = os.environ.get("DEEPL_API_KEY")
         if self.deeplApiKey:
-            self.deepl_auth_object = deepl.Translator(self.deeplApiKey)
+            deepl.http_client.min_connection_timeout = float(os.environ.get("DEEPL_TIMEOUT", "10"))
+            deepl.http_client.max_network_retries = int(os.environ.get("DEEPL_MAX_RETRIES", "5"))
+            self.deepl_auth_object = deepl.Translator(
+                self.deeplApiKey, server_url=os.environ.get("DEEPL_SERVER_URL") or None
+            )
+            self._mount_connection_pool(int(os.environ.get("DEEPL_POOL_SIZE", "16")))
         else:
             raise Exception("DEEPL_API_KEY not found in .env file")
 
+    def _mount_connection_pool(self, pool_size: int):
+        # the translator keeps one requests session, size its pool for concurrent requests
+        session = getattr(getattr(self.deepl_auth_object, "_client", None), "_session", None)
+        if session is None:
+            return
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
 
 class ADMIN_AUTH(metaclass=Singleton):
     """Admin Authentication Class. This class is a singleton and should only be initialized once."""
@@ -0,0 +1,137 @@
+"""
+Subtitle combining and speaking rate benchmarks
+
+Run from api/src, the SSML_Customization and LANGUAGES folders are read relative to it:
+
+    python -m benchmarks.bench_combine                       # 1k, 10k and 50k cues, the legacy loop up to 1k
+    python -m benchmarks.bench_combine --legacy-max-cues 2000
+    python -m benchmarks.bench_combine --save-baseline       # write baselines/combine.json
+    python -m benchmarks.bench_combine --check               # exit 1 if slower than the baseline or an output differs
+
+Both copies of `combine_subtitles_advanced` (translate.py and translate_utils.py) are timed on the same synthetic tracks. For the sizes the legacy `combine_single_pass` loop can still finish, it is run too, and the outputs of both copies are compared with it. `passes` is the number of legacy passes and `merges` the number of cues merged away.
+"""
+import argparse
+import sys
+
+import translate
+import translate_utils
+from benchmarks.runner import compare_to_baseline, measure, print_table, save_baseline
+from benchmarks.synthetic import synthetic_srt_lines
+from subtitle_combine import speaking_rates
+from utils import srt_to_dict
+
+BASELINE_NAME = "combine"
+DEFAULT_SIZES = (1000, 10000, 50000)
+LEGACY_MAX_CUES = 1000
+BUFFER_MS = 0
+CHAR_RATE_GOAL = 20
+
+
+def synthetic_translated_track(n_cues: int):
+    """A synthetic track with the source text used as the translation"""
+    track = srt_to_dict(synthetic_srt_lines(n_cues, seed=n_cues), BUFFER_MS)
+    track.translated_text = list(track.text)
+    return track
+
+
+def run_legacy_counted(track):
+    """Runs `combine_subtitles_legacy` once, counting its passes
+
+    Returns
+    -------
+    (SubtitleTrack, int)
+        the combined track and the number of `combine_single_pass` calls
+    """
+    calls = 0
+    original = translate_utils.combine_single_pass
+
+    def counted(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return original(*args, **kwargs)
+
+    translate_utils.combine_single_pass = counted
+    try:
+        combined = translate_utils.combine_subtitles_legacy(track)
+    finally:
+        translate_utils.combine_single_pass = original
+    return combined, calls
+
+
+def run(sizes=DEFAULT_SIZES, repeat: int = 3, legacy_max_cues: int = LEGACY_MAX_CUES) -> dict:
+    results = {}
+
+    def record(case: str, n_cues: int, fn, repeat: int = repeat, **extra) -> dict:
+        result = measure(fn, repeat)
+        result["cues"] = n_cues
+        result["cues_per_s"] = round(n_cues / result["seconds"]) if result["seconds"] else None
+        result.update(extra)
+        results[case] = result
+        return result
+
+    for n in sizes:
+        track = synthetic_translated_track(n)
+        entries = [dict(value) for value in track.values()]
+
+        record(f"speaking_rates/{n}", n, lambda: speaking_rates([len(t) for t in track.translated_text], track.duration_ms, CHAR_RATE_GOAL))
+        record(f"calc_list_speaking_rates/{n}", n, lambda: translate_utils.calc_list_speaking_rates(entries, CHAR_RATE_GOAL))
+
+        combined = {
+            "translate": translate.combine_subtitles_advanced(track),
+            "translate_utils": translate_utils.combine_subtitles_advanced(track),
+        }
+        legacy = None
+        if n <= legacy_max_cues:
+            legacy, passes = run_legacy_counted(track)
+            legacyResult = record(
+                f"combine_subtitles_legacy/{n}",
+                n,
+                lambda: translate_utils.combine_subtitles_legacy(track),
+                repeat=1,
+                passes=passes,
+                merges=n - len(legacy),
+            )
+
+        for module, fn in (
+            ("translate", translate.combine_subtitles_advanced),
+            ("translate_utils", translate_utils.combine_subtitles_advanced),
+        ):
+            extra = {"merges": n - len(combined[module])}
+            if legacy is not None:
+                extra["same_output"] = "yes" if combined[module].to_dict() == legacy.to_dict() else "no"
+            result = record(f"{module}.combine_subtitles_advanced/{n}", n, lambda: fn(track), **extra)
+            if legacy is not None and result["seconds"]:
+                result["speedup"] = round(legacyResult["seconds"] / result["seconds"], 1)
+
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of cues per synthetic track")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best time is kept. The legacy loop runs once")
+    parser.add_argument("--legacy-max-cues", type=int, default=LEGACY_MAX_CUES, help="largest track to run the legacy loop on")
+    parser.add_argument("--save-baseline", action="store_true", help=f"save the results to baselines/{BASELINE_NAME}.json")
+    parser.add_argument("--check", action="store_true", help="compare with the saved baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --check, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.legacy_max_cues)
+    print_table(results, ("cues", "seconds", "cues_per_s", "peak_mb", "passes", "merges", "same_output", "speedup"))
+
+    mismatches = [case for case, result in results.items() if result.get("same_output") == "no"]
+    for case in mismatches:
+        print(f"OUTPUT DIFFERS FROM LEGACY {case}")
+
+    if args.save_baseline:
+        print(f"Baseline saved to {save_baseline(BASELINE_NAME, results)}")
+    if args.check:
+        regressions = compare_to_baseline(BASELINE_NAME, results, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions or mismatches else 0
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
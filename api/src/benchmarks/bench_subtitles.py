@@ -0,0 +1,86 @@
+"""
+Subtitle parsing and serialization benchmarks
+
+Run from api/src, the SSML_Customization and LANGUAGES folders are read relative to it:
+
+    python -m benchmarks.bench_subtitles                     # 1k, 10k and 100k cues
+    python -m benchmarks.bench_subtitles --save-baseline     # write baselines/subtitles.json
+    python -m benchmarks.bench_subtitles --check             # exit 1 if slower than the baseline
+
+Baselines are machine specific and not committed, save one with --save-baseline on the base commit before using --check, see `benchmarks.runner`.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks.runner import compare_to_baseline, measure, print_table, save_baseline
+from benchmarks.synthetic import synthetic_srt, synthetic_srt_lines
+from settings import Srt_Timestamp
+from subtitle_writer import render_subtitles
+from subtitles import SRT_TIMESTAMP_LINE_REGEX
+from translate_utils import create_sub_dict
+from utils import srt_to_dict, tanslated_srt_to_file
+
+BASELINE_NAME = "subtitles"
+DEFAULT_SIZES = (1000, 10000, 100000)
+BUFFER_MS = 30
+
+
+def run(sizes=DEFAULT_SIZES, repeat: int = 3) -> dict:
+    results = {}
+
+    def record(case: str, n_cues: int, fn) -> None:
+        result = measure(fn, repeat)
+        result["cues"] = n_cues
+        result["cues_per_s"] = round(n_cues / result["seconds"]) if result["seconds"] else None
+        results[case] = result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            for hour_digits in (1, 2):
+                lines = synthetic_srt_lines(n, seed=n, hour_digits=hour_digits)
+                record(f"srt_to_dict/{n}/h{hour_digits}", n, lambda: srt_to_dict(lines, BUFFER_MS))
+
+                path = os.path.join(tmp, f"{n}-h{hour_digits}.srt")
+                with open(path, "w", encoding="utf-8-sig") as f:
+                    f.write(synthetic_srt(n, seed=n, hour_digits=hour_digits))
+                record(f"create_sub_dict/{n}/h{hour_digits}", n, lambda: create_sub_dict(path, BUFFER_MS))
+
+            timestamp_lines = [line for line in synthetic_srt_lines(n, seed=n) if SRT_TIMESTAMP_LINE_REGEX.match(line)]
+            record(f"Srt_Timestamp/{n}", n, lambda: [Srt_Timestamp(line) for line in timestamp_lines])
+
+            track = srt_to_dict(synthetic_srt_lines(n, seed=n), BUFFER_MS)
+            track.translated_text = list(track.text)
+            dst = os.path.join(tmp, f"{n}-out.srt")
+            record(f"tanslated_srt_to_file/{n}", n, lambda: tanslated_srt_to_file(track, dst))
+            for fmt in ("vtt", "ass"):
+                record(f"render_subtitles/{fmt}/{n}", n, lambda: render_subtitles(track, fmt))
+
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of cues per synthetic file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best time is kept")
+    parser.add_argument("--save-baseline", action="store_true", help=f"save the results to baselines/{BASELINE_NAME}.json")
+    parser.add_argument("--check", action="store_true", help="compare with the saved baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --check, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+    print_table(results, ("cues", "seconds", "cues_per_s", "peak_mb"))
+
+    if args.save_baseline:
+        print(f"Baseline saved to {save_baseline(BASELINE_NAME, results)}")
+    if args.check:
+        regressions = compare_to_baseline(BASELINE_NAME, results, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
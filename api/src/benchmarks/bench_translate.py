@@ -0,0 +1,134 @@
+"""
+Translation throughput benchmark, run against the local DeepL stand-in in `benchmarks.deepl_stub`
+
+Run from api/src, the SSML_Customization and LANGUAGES folders are read relative to it:
+
+    python -m benchmarks.bench_translate                          # 100, 1k and 10k cues, 80ms DeepL latency
+    python -m benchmarks.bench_translate --latency-ms 200 --error-rate 0.05 --rate-limit 20
+    python -m benchmarks.bench_translate --languages DE FR ES JA  # also time the per language fan-out of the endpoint
+    python -m benchmarks.bench_translate --save-baseline          # write baselines/translate.json
+    python -m benchmarks.bench_translate --check                  # exit 1 if slower than the baseline
+
+The DeepL client is pointed at the stand-in through DEEPL_SERVER_URL and the translation memory is disabled unless --memory is given, so every run sends the same requests. The fan-out case calls `main.translate_languages` with a user that writes the uploads to memory, the Firebase authorization of the HTTP endpoint is not part of it.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from benchmarks.deepl_stub import DeepLStub
+from benchmarks.runner import compare_to_baseline, print_table, save_baseline
+from benchmarks.synthetic import synthetic_srt_lines
+
+BASELINE_NAME = "translate"
+DEFAULT_SIZES = (100, 1000, 10000)
+
+
+class NullUser:
+    """Stands in for `user.USER` in the fan-out case, the uploads are rendered into memory"""
+
+    def upload_translation(self, file, order_id, language):
+        return True
+
+    def upload_subtitles(self, subs_dict, order_id, language):
+        from subtitle_writer import SUBTITLE_FORMATS, write_subtitles
+
+        for fmt in SUBTITLE_FORMATS:
+            write_subtitles(subs_dict, io.BytesIO(), fmt=fmt)
+        return True
+
+
+def run(stub: DeepLStub, sizes=DEFAULT_SIZES, repeat: int = 1, languages=(), combine: bool = False) -> dict:
+    # imported here, the DeepL client settings are read from the environment set up by `main`
+    from translate import translate
+    from utils import srt_to_dict
+
+    results = {}
+
+    def record(case: str, n_cues: int, fn) -> None:
+        best = None
+        for _ in range(repeat):
+            stub.reset_stats()
+            start = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best["seconds"]:
+                best = {"seconds": round(seconds, 4), **stub.stats}
+        best["cues"] = n_cues
+        best["cues_per_s"] = round(n_cues / best["seconds"]) if best["seconds"] else None
+        results[case] = best
+
+    for n in sizes:
+        track = srt_to_dict(synthetic_srt_lines(n, seed=n), 0)
+        record(f"translate/{n}", n, lambda: translate(track, "DE", combine_subtitles=combine))
+        record(
+            f"translate/{n}/placeholders",
+            n,
+            lambda: translate(track, "DE", combine_subtitles=combine, protect_with_placeholders=True),
+        )
+
+        if languages:
+            from main import translate_languages
+            from settings import Dubbing_Settings, Order
+
+            instances = [
+                Dubbing_Settings(translation_target_language=language, combine_subtitles=combine).dict()
+                for language in languages
+            ]
+            data = Order(order_id="benchmark", dubbing_instances=[Dubbing_Settings(**i) for i in instances])
+            record(
+                f"fan_out/{n}/{len(languages)}_languages",
+                n * len(languages),
+                lambda: translate_languages(instances, data, NullUser(), track),  # type: ignore
+            )
+
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of cues per synthetic file")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the best time is kept")
+    parser.add_argument("--latency-ms", type=float, default=80, help="latency of every DeepL request")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra latency of every DeepL request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of DeepL requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, default=None, help="DeepL requests per second before 429s")
+    parser.add_argument("--languages", nargs="*", default=[], help="DeepL language codes for the fan-out case")
+    parser.add_argument("--combine", action="store_true", help="also combine the subtitles, as orders do by default")
+    parser.add_argument("--memory", action="store_true", help="keep the translation memory enabled")
+    parser.add_argument("--save-baseline", action="store_true", help=f"save the results to baselines/{BASELINE_NAME}.json")
+    parser.add_argument("--check", action="store_true", help="compare with the saved baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown for --check, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    with DeepLStub(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    ) as stub:
+        os.environ["DEEPL_SERVER_URL"] = stub.url
+        os.environ.setdefault("DEEPL_API_KEY", "benchmark")
+        if not args.memory:
+            os.environ["TRANSLATION_MEMORY_PATH"] = ""
+
+        results = run(stub, args.sizes, args.repeat, args.languages, args.combine)
+
+    print_table(
+        results,
+        ("cues", "seconds", "cues_per_s", "requests", "bytes_sent", "characters", "max_concurrent", "errors_injected", "rate_limited"),
+    )
+
+    if args.save_baseline:
+        print(f"Baseline saved to {save_baseline(BASELINE_NAME, results)}")
+    if args.check:
+        regressions = compare_to_baseline(BASELINE_NAME, results, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
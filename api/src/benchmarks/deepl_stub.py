@@ -0,0 +1,193 @@
+"""
+A local stand-in for the DeepL API, so `translate()` can be benchmarked without the network or a paid key
+
+It speaks the part of the API `deepl.Translator` uses for text: POST /v2/translate (form or json body) and /v2/usage. A translation is the target language code prepended to the text, tags are left as they are. The DeepL limits of 50 texts and 128 KiB per request are enforced.
+
+    with DeepLStub(latency_ms=80) as stub:
+        os.environ["DEEPL_SERVER_URL"] = stub.url
+        ...
+        print(stub.stats)
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs
+
+MAX_TEXTS_PER_REQUEST = 50
+MAX_REQUEST_BYTES = 128 * 1024
+
+
+class DeepLStub:
+    """
+    Parameters
+    ----------
+    latency_ms: float
+        time added to every translate request
+    jitter_ms: float
+        random extra latency, up to this many milliseconds
+    error_rate: float
+        share of translate requests answered with a 503, which the deepl client retries
+    rate_limit: float | None
+        maximum translate requests per second, requests over it are answered with a 429
+    seed: int
+        seed of the latency jitter and the injected errors
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0.0,
+        rate_limit: Optional[float] = None,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: list = []
+        self.reset_stats()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def do_POST(self):
+                stub._handle(self)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "texts": 0,
+                "bytes_sent": 0,
+                "characters": 0,
+                "errors_injected": 0,
+                "rate_limited": 0,
+                "max_concurrent": 0,
+                "max_request_bytes": 0,
+            }
+            self._in_flight = 0
+
+    def start(self) -> "DeepLStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "DeepLStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ------------------------------------------------------------------
+
+    def _send(self, handler, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _read_params(self, handler) -> tuple:
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        if "json" in (handler.headers.get("Content-Type") or ""):
+            params = json.loads(raw or b"{}")
+            texts = params.get("text") or []
+            texts = [texts] if isinstance(texts, str) else texts
+        else:
+            query = parse_qs(raw.decode("utf-8"), keep_blank_values=True)
+            params = {key: values[-1] for key, values in query.items()}
+            texts = query.get("text", [])
+        return raw, params, texts
+
+    def _rate_limited(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._recent = [t for t in self._recent if now - t < 1.0]
+            if len(self._recent) >= self.rate_limit:
+                return True
+            self._recent.append(now)
+        return False
+
+    def _handle(self, handler) -> None:
+        path = handler.path.split("?")[0]
+        if not (handler.headers.get("Authorization") or "").startswith("DeepL-Auth-Key "):
+            return self._send(handler, 403, {"message": "Missing auth key"})
+
+        raw, params, texts = self._read_params(handler)
+        if path == "/v2/usage":
+            with self._lock:
+                return self._send(handler, 200, {"character_count": self.stats["characters"], "character_limit": 10**12})
+        if path != "/v2/translate":
+            return self._send(handler, 404, {"message": "Not found"})
+
+        with self._lock:
+            self.stats["max_request_bytes"] = max(self.stats["max_request_bytes"], len(raw))
+        if len(raw) > MAX_REQUEST_BYTES:
+            return self._send(handler, 413, {"message": "Request Entity Too Large"})
+        if not texts or len(texts) > MAX_TEXTS_PER_REQUEST or not params.get("target_lang"):
+            return self._send(handler, 400, {"message": "Bad request"})
+        if self._rate_limited():
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            return self._send(handler, 429, {"message": "Too many requests"})
+
+        with self._lock:
+            inject = self._rng.random() < self.error_rate
+            delay = (self.latency_ms + self._rng.random() * self.jitter_ms) / 1000
+            self._in_flight += 1
+            self.stats["max_concurrent"] = max(self.stats["max_concurrent"], self._in_flight)
+        try:
+            time.sleep(delay)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if inject:
+            with self._lock:
+                self.stats["errors_injected"] += 1
+            return self._send(handler, 503, {"message": "Injected error"})
+
+        target = params["target_lang"].upper()
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["bytes_sent"] += len(raw)
+            self.stats["characters"] += sum(len(text) for text in texts)
+        self._send(
+            handler,
+            200,
+            {"translations": [{"detected_source_language": "EN", "text": f"{target}: {text}"} for text in texts]},
+        )
@@ -0,0 +1,97 @@
+"""Timing, memory and baseline helpers shared by the benchmarks
+
+Baselines are timings of one machine, so they are not committed, baselines/ is ignored. Save one on the machine you compare on, before the change, then check against it after:
+
+    python -m benchmarks.bench_subtitles --save-baseline    # on the base commit
+    python -m benchmarks.bench_subtitles --check            # with the change
+"""
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def measure(fn: Callable[[], object], repeat: int = 3) -> dict:
+    """Runs `fn` `repeat` times for the best wall time, then once more under tracemalloc for the peak memory
+
+    Returns
+    -------
+    dict
+        {"seconds": float, "peak_mb": float}
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": round(best, 6), "peak_mb": round(peak / 1024 / 1024, 3)}
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINES_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, results: dict) -> str:
+    """Writes the results to `baselines/<name>.json` and returns the path"""
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, "w") as f:
+        json.dump(
+            {"python": platform.python_version(), "machine": platform.machine(), "results": results},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+    return path
+
+
+def load_baseline(name: str) -> Optional[dict]:
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare_to_baseline(name: str, results: dict, metric: str = "seconds", tolerance: float = 0.25) -> list:
+    """Compares results with the saved baseline
+
+    Returns
+    -------
+    list
+        a message for every case where `metric` is more than `tolerance` worse than the baseline
+    """
+    baseline = load_baseline(name)
+    if baseline is None:
+        return [f"No baseline saved for {name}, run with --save-baseline first"]
+
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        before, after = baseline[case][metric], result[metric]
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{case}: {metric} {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_table(results: dict, columns: tuple) -> None:
+    width = max([len(case) for case in results] + [4])
+    print(f"{'case':<{width}}  " + "  ".join(f"{c:>12}" for c in columns))
+    for case, result in results.items():
+        print(f"{case:<{width}}  " + "  ".join(f"{result.get(c, ''):>12}" for c in columns))
@@ -0,0 +1,62 @@
+"""Synthetic subtitle data for the benchmarks. Everything is seeded so runs are comparable"""
+import random
+from typing import Iterator, List, Tuple
+
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have from "
+    "or one had by word but not what all were we when your can said there use an each which she "
+    "do how their if will up other about out many then them these so some her would make like him "
+    "into time has look two more write go see number no way could people my than first water been "
+    "call who oil its now find long down day did get come made may part video subscribe channel"
+).split()
+
+
+def synthetic_cues(n_cues: int, seed: int = 0, max_text_lines: int = 3) -> Iterator[Tuple[int, int, List[str]]]:
+    """Yields (start_ms, end_ms, text_lines) with realistic gap and length distributions
+
+    Gaps are mostly back to back (< 100ms) with some pauses, durations are 0.5 - 4.5 seconds (100k cues stay under 100 hours) and the text is spoken at roughly 10 - 22 characters per second
+    """
+    rng = random.Random(seed)
+    t = 0
+    for _ in range(n_cues):
+        roll = rng.random()
+        if roll < 0.6:
+            gap = rng.randint(0, 99)
+        elif roll < 0.9:
+            gap = rng.randint(100, 600)
+        else:
+            gap = rng.randint(600, 3000)
+        duration = rng.randint(500, 4500)
+        start = t + gap
+        end = start + duration
+        t = end
+
+        n_chars = max(1, int(duration / 1000 * rng.uniform(10, 22)))
+        words: List[str] = []
+        while sum(len(w) + 1 for w in words) < n_chars:
+            words.append(rng.choice(WORDS))
+        n_lines = rng.randint(1, max_text_lines)
+        per_line = max(1, -(-len(words) // n_lines))
+        yield start, end, [" ".join(words[x : x + per_line]) for x in range(0, len(words), per_line)]
+
+
+def format_time(ms: int, hour_digits: int = 2) -> str:
+    """Formats milliseconds as an srt timestamp, with one (H:MM:SS,mmm) or two (HH:MM:SS,mmm) hour digits"""
+    hours = f"{ms // 3600000}" if hour_digits == 1 else f"{ms // 3600000:02d}"
+    return f"{hours}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def synthetic_srt_lines(n_cues: int, seed: int = 0, hour_digits: int = 2, max_text_lines: int = 3) -> List[str]:
+    """Returns the lines of a synthetic srt file with `n_cues` cues"""
+    lines = []
+    for number, (start, end, text) in enumerate(synthetic_cues(n_cues, seed, max_text_lines), start=1):
+        lines.append(str(number))
+        lines.append(f"{format_time(start, hour_digits)} --> {format_time(end, hour_digits)}")
+        lines.extend(text)
+        lines.append("")
+    return lines
+
+
+def synthetic_srt(n_cues: int, seed: int = 0, hour_digits: int = 2, max_text_lines: int = 3) -> str:
+    """Returns a synthetic srt file with `n_cues` cues"""
+    return "\n".join(synthetic_srt_lines(n_cues, seed, hour_digits, max_text_lines)) + "\n"
@@ -1,16 +1,75 @@
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from urllib.parse import quote_plus
 
 from api_auth import DEEPL_AUTH
 from deepl.translator import TextResult
+from timing import span
+
+# DeepL accepts at most 50 texts and 128 KiB of request body per translate request
+DEEPL_MAX_TEXTS_PER_REQUEST = 50
+DEEPL_MAX_REQUEST_BYTES = 128 * 1024
+# Room for the parameters besides the texts, i.e. target_lang, formality and tag_handling
+DEEPL_FORM_OVERHEAD_BYTES = 1024
+DEEPL_MAX_BYTES_PER_REQUEST = DEEPL_MAX_REQUEST_BYTES - DEEPL_FORM_OVERHEAD_BYTES
+# Maximum number of requests of one translate_many call in flight at the same time
+DEEPL_MAX_CONCURRENT_REQUESTS = int(os.environ.get("DEEPL_MAX_CONCURRENT_REQUESTS", "4"))
+
+
+def encoded_text_size(text: str) -> int:
+    """The size of a text in the form-urlencoded body the deepl client sends, i.e. `text=...&`. Non-ASCII characters take 3 bytes per utf-8 byte"""
+    return len(quote_plus(text)) + len("text=&")
+
+
+def pack_texts(
+    texts: list,
+    max_texts: int = DEEPL_MAX_TEXTS_PER_REQUEST,
+    max_bytes: int = DEEPL_MAX_BYTES_PER_REQUEST,
+) -> List[list]:
+    """Packs texts into as few requests as the DeepL limits allow, keeping their order
+
+    Parameters
+    ----------
+    texts : list
+        the texts to translate
+    max_texts : int
+        maximum number of texts per request
+    max_bytes : int
+        maximum form-urlencoded size of the texts of a request, see `encoded_text_size`. A longer single text gets a request of its own
+
+    Returns
+    -------
+    List[list]
+        the indices into `texts` of each request
+    """
+    requests = []
+    current: list = []
+    currentBytes = 0
+    for i, text in enumerate(texts):
+        size = encoded_text_size(text)
+        if current and (len(current) >= max_texts or currentBytes + size > max_bytes):
+            requests.append(current)
+            current = []
+            currentBytes = 0
+        current.append(i)
+        currentBytes += size
+    if current:
+        requests.append(current)
+    return requests
 
 
 class DEEPL_API(DEEPL_AUTH):
-    """The base class for the DeepL API
+    """The base class for the DeepL API. This class is a singleton, calling `DEEPL_API()` returns the process wide client
 
     Methods
     -------
     translate_text(text: list, target_lang: str, tag_handling: str = "html")
         translates a list of strings to a target language
+    translate_many(texts: list, target_lang: str, formality: str = "default", tag_handling: str = "html")
+        translates any number of strings, packed into parallel requests
     """
 
     def __init__(self):
@@ -48,3 +107,59 @@ class DEEPL_API(DEEPL_AUTH):
         )
 
         return response
+
+    def translate_many(
+        self,
+        texts: list,
+        target_lang: str,
+        formality: str = "default",
+        tag_handling: str = "html",
+        max_concurrent_requests: int = DEEPL_MAX_CONCURRENT_REQUESTS,
+    ) -> List[str]:
+        """Translates any number of strings. They are packed into requests up to the DeepL limits, see `pack_texts`, which are sent in parallel
+
+        Parameters
+        ----------
+        texts : list
+            A list of strings to be translated
+        target_lang : str
+            The target language to translate to
+        formality : str, optional
+            The formality of the translation, by default "default"
+        tag_handling : str, optional
+            The tag handling to use, by default "html"
+        max_concurrent_requests : int, optional
+            Maximum number of requests in flight at the same time
+
+        Returns
+        -------
+        List[str]
+            The translated strings, in the order of `texts`
+        """
+        packed = pack_texts(texts)
+        logging.debug(f"[DeepL] Translating {len(texts)} texts in {len(packed)} requests")
+
+        def send(indices):
+            with span("deepl_request"):
+                return self.translate_text(
+                    [texts[i] for i in indices],
+                    target_lang=target_lang,
+                    formality=formality,
+                    tag_handling=tag_handling,
+                )
+
+        translated: List[str] = [""] * len(texts)
+        if len(packed) == 1:
+            results = [send(packed[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrent_requests, len(packed)))) as executor:
+                # each request runs in a copy of this context, so its timing spans are recorded for the caller's request
+                futures = [executor.submit(contextvars.copy_context().run, send, indices) for indices in packed]
+                results = [future.result() for future in futures]
+
+        # Results are in the same order as the texts of their request
+        for indices, result in zip(packed, results):
+            for i, r in zip(indices, result):  # type: ignore
+                translated[i] = r.text
+
+        return translated
@@ -1,9 +1,11 @@
 # main.py
 
+import contextvars
 import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import AuthenticationError
 from pathlib import Path
 from sys import stdout
@@ -12,11 +14,16 @@ import requests
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from settings import Dubbing_Settings, Order
-from translate import translate
+from subtitles import SubtitleTrack, iter_chunk_lines
+from timing import Timings, collect_timings, span, timed
+from track_cache import (load_cached_track, save_cached_track,
+                         track_artifact_path, track_cache_key)
+from translate import glossary_version, translate
 from typing import Literal
 from user import USER
 from utils import download_srt_file, srt_to_dict, tanslated_srt_to_file
-from voice_synth import synthesize_text_azure_batch
+from voice_rate_model import VOICE_RATE_SECOND_PASS, VoiceRateModel, predict_speed_factors, voice_model_key
+from voice_synth import synthesis_hashes, synthesize_with_rate_model
 load_dotenv()
 
 logging.basicConfig(
@@ -28,11 +35,15 @@ logging.basicConfig(
 
 app = FastAPI()
 
+# Maximum number of languages of one order translated at the same time
+MAX_TRANSLATION_WORKERS = int(os.environ.get("MAX_TRANSLATION_WORKERS", "4"))
+
 
 
 # ----------------------#
 #    BUISNESS LOGIC    #
 # ----------------------#
+@timed()
 def authorize(request: Request) -> USER:
     """Authorizes user
     
@@ -65,9 +76,10 @@ def authorize(request: Request) -> USER:
     except Exception as e:
         raise AuthenticationError(str(e))
 
-def get_main_srt_file(user: USER, order: dict):
+@timed()
+def get_main_srt_file(user: USER, order: dict) -> SubtitleTrack:
     """
-    Downloads main srt file from storage and converts it to the subs dict
+    Downloads main srt file from storage and converts it to a subtitle track
 
     Parameters
     ----------
@@ -78,8 +90,8 @@ def get_main_srt_file(user: USER, order: dict):
 
     Returns
     -------
-    dict:
-        Subs dict
+    SubtitleTrack:
+        Subtitle track
 
     Raises
     ------
@@ -92,21 +104,58 @@ def get_main_srt_file(user: USER, order: dict):
     
     id = order.get("main_srt").split("/")[-2] # type: ignore
 
+    main_srt = order["main_srt"]
+    buffer = order['dubbing_settings'].get("add_line_buffer_milliseconds")
+
+    # the parsed track is cached by the md5 and generation of the srt file, so repeat orders skip the download and the parse. The cache never fails an order, any error falls back to the download
+    try:
+        blob = user.get_blob_metadata(main_srt)
+    except Exception as e:
+        logging.debug(f"COULD NOT GET SRT METADATA: {e}")
+        blob = None
+    if blob != None:
+        key = track_cache_key(blob.md5_hash, blob.generation, buffer)
+        subs_dict = load_cached_track(key)
+        if subs_dict != None:
+            logging.debug(f"USING LOCAL TRACK ARTIFACT: {key}")
+            return subs_dict
+
+        artifact_path = track_artifact_path(main_srt, buffer)
+        try:
+            artifact = user.download_track_artifact(artifact_path, blob.md5_hash, blob.generation)
+            subs_dict = SubtitleTrack.from_bytes(artifact) if artifact != None else None
+        except Exception as e:
+            logging.debug(f"COULD NOT LOAD TRACK ARTIFACT {artifact_path}: {e}")
+            subs_dict = None
+        if subs_dict != None:
+            logging.debug(f"USING STORED TRACK ARTIFACT: {artifact_path}")
+            save_cached_track(key, artifact)
+            return subs_dict
+
     # download main srt
-    logging.debug(f"CREATING DOWNLOAD URL. PATH: {order.get('main_srt')}")
-    main_srt_url = user.create_download_url(path=order.get("main_srt"))
+    logging.debug(f"CREATING DOWNLOAD URL. PATH: {main_srt}")
+    main_srt_url = user.create_download_url(path=main_srt)
 
-    with requests.get(main_srt_url, stream=True) as r:
+    # parse while downloading, only the current chunk and cue are held in memory
+    with span("download_and_parse"), requests.get(main_srt_url, stream=True) as r:
         r.raise_for_status()
-        r.content.decode("utf-8")
-        lines = r.content.decode("utf-8").split("\n")
         subs_dict = srt_to_dict(
-            lines, order['dubbing_settings'].get("add_line_buffer_milliseconds")
+            iter_chunk_lines(r.iter_content(chunk_size=16384)),
+            buffer,
         )
 
+    if blob != None:
+        try:
+            artifact = subs_dict.to_bytes()
+            save_cached_track(key, artifact)
+            user.upload_track_artifact(artifact_path, artifact, blob.md5_hash, blob.generation)
+        except Exception as e:
+            # the artifact is only a cache, the order can go on without it
+            logging.debug(f"COULD NOT UPLOAD TRACK ARTIFACT: {e}")
+
     return subs_dict
 
-def to_subs_dict(file: Path, order: dict) -> dict:
+def to_subs_dict(file: Path, order: dict) -> SubtitleTrack:
 
     dubbing_settings = order["dubbing_settings"]
     logging.debug(f"DUBBING SETTINGS: {dubbing_settings}")
@@ -114,18 +163,88 @@ def to_subs_dict(file: Path, order: dict) -> dict:
         dubbing_settings.get("add_line_buffer_milliseconds") != None
     ), "No add_line_buffer_milliseconds"
 
-    with open(file, "r") as f:
-        lines = f.readlines()
-        
-        logging.debug(f"SUBS LINES READ. LEN: {len(lines)}")
-        
+    with open(file, "r", encoding="utf-8-sig") as f:
         subs_dict = srt_to_dict(
-            lines, dubbing_settings.get("add_line_buffer_milliseconds")
+            f, dubbing_settings.get("add_line_buffer_milliseconds")
         )
         return subs_dict
 
+def get_previous_order(user: USER, data: Order) -> dict | None:
+    """Gets the order this order re-processes, if any
+
+    Parameters
+    ----------
+    user (USER):
+        User object
+    data (Order):
+        Order data
+
+    Returns
+    -------
+    dict | None:
+        Previous order info, None if there is no previous order or it can't be read
+    """
+    if not data.previous_order_id or data.previous_order_id == data.order_id:
+        return None
+    try:
+        previous_order = user.get_order(data.previous_order_id)
+    except Exception as e:
+        logging.warning(f"COULD NOT GET PREVIOUS ORDER {data.previous_order_id}: {e}")
+        return None
+    if previous_order is not None:
+        previous_order["order_id"] = data.previous_order_id
+    return previous_order
+
+def cue_translation_settings(dubbing_instance: dict) -> dict:
+    """The settings a stored cue translation depends on besides the text. Cues are only reused by an order with the same settings"""
+    return {
+        "formality_preference": dubbing_instance.get("formality_preference"),
+        "protect_with_placeholders": bool(dubbing_instance.get("protect_with_placeholders")),
+        "glossary_version": glossary_version(),
+    }
+
+def get_previous_cue_translations(user: USER, previous_order: dict | None, dubbing_instance: dict) -> dict:
+    """Gets the per cue translations of the previous order for the same language, if they were made with the same formality, placeholder mode and SSML_Customization glossary files
+
+    Returns
+    -------
+    dict:
+        {cue hash: translated text}, empty if nothing can be reused
+    """
+    language = dubbing_instance.get("translation_target_language")
+    path = ((previous_order or {}).get("translations") or {}).get(language)
+    if not path or not path.endswith(".json"):
+        return {}
+    try:
+        previous = user.download_json(path)
+    except Exception as e:
+        logging.warning(f"COULD NOT GET PREVIOUS TRANSLATION {path}: {e}")
+        return {}
+    if previous.get("translation_settings") != cue_translation_settings(dubbing_instance):
+        logging.debug(f"TRANSLATION SETTINGS CHANGED, NOT REUSING {path}")
+        return {}
+    return previous.get("cue_translations") or {}
+
+def get_previous_dub_files(user: USER, previous_order: dict | None, language: str) -> dict:
+    """Gets the clip manifest of the previous order's dub for a language
+
+    Returns
+    -------
+    dict:
+        {synthesis hash: file_name}, empty if nothing can be reused
+    """
+    path = ((previous_order or {}).get("dubs") or {}).get(language)
+    if not path or not path.startswith(user.user.uid):
+        return {}
+    try:
+        return user.download_json(f"{path}/manifest.json")
+    except Exception as e:
+        logging.warning(f"COULD NOT GET PREVIOUS DUB MANIFEST {path}: {e}")
+        return {}
+
+@timed()
 def run_translate(
-    dubbing_instance: dict, data: Order, user: USER, subs_dict: dict
+    dubbing_instance: dict, data: Order, user: USER, subs_dict: SubtitleTrack, previous_order: dict | None = None
 )  -> dict[str, Any]:
     """Runs translation and uploads to storage
     
@@ -137,8 +256,10 @@ def run_translate(
         Order data
     user (USER):
         User object
-    subs_dict (dict):
-        Subtitles dict
+    subs_dict (SubtitleTrack):
+        Subtitle track
+    previous_order (dict | None):
+        Previous order info, unchanged cues reuse its translations
     
     Returns
     -------
@@ -148,16 +269,22 @@ def run_translate(
             "order_settings": data.settings.dict(),
             "dubbing_instance": dubbing_instance,
             "t_subs_dict": t_subs_dict,
+            "cue_translations": {cue hash: translated text},
+            "translation_settings": the settings the cue translations were made with, see `cue_translation_settings`,
         }
 
     """
     logging.debug(f"TRANSLATING: {dubbing_instance.get('translation_target_language')}")
+    translation_settings = cue_translation_settings(dubbing_instance)
+    cue_translations = get_previous_cue_translations(user, previous_order, dubbing_instance)
     t_subs_dict = translate(
         subs_dict=subs_dict,
         target_language=dubbing_instance.get("translation_target_language"),  # type: ignore
         formality=dubbing_instance.get("formality_preference"),  # type: ignore
         combine_subtitles=dubbing_instance.get("combine_subtitles"),  # type: ignore
         combine_max_characters=dubbing_instance.get("combine_subtitles_max_chars"),  # type: ignore
+        cue_translations=cue_translations,
+        protect_with_placeholders=bool(dubbing_instance.get("protect_with_placeholders")),
     )
 
     logging.debug(
@@ -169,17 +296,77 @@ def run_translate(
         "order_settings": data.settings.dict(),
         "dubbing_instance": dubbing_instance,
         "t_subs_dict": t_subs_dict,
+        "cue_translations": cue_translations,
+        "translation_settings": translation_settings,
     }
 
     user.upload_translation(
-        file=json.dumps(out),
+        file=json.dumps({**out, "t_subs_dict": t_subs_dict.to_dict()}),
+        order_id=data.order_id,
+        language=dubbing_instance.get("translation_target_language"),
+    )
+
+    logging.debug(
+        f"UPLOADING TRANSLATED SUBTITLES: {dubbing_instance.get('translation_target_language')}"
+    )
+    user.upload_subtitles(
+        subs_dict=t_subs_dict,
         order_id=data.order_id,
         language=dubbing_instance.get("translation_target_language"),
     )
 
     return out
 
-def dubs(translated_subs: dict, user: USER, order_id: str):
+def translate_languages(
+    dubbing_instances: list, data: Order, user: USER, subs_dict: SubtitleTrack, previous_order: dict | None = None
+) -> tuple[dict, dict]:
+    """Runs `run_translate` for every language of the order concurrently, on at most MAX_TRANSLATION_WORKERS threads
+
+    Parameters
+    ----------
+    dubbing_instances (list):
+        Dubbing instances of the order
+    data (Order):
+        Order data
+    user (USER):
+        User object
+    subs_dict (SubtitleTrack):
+        Subtitle track, it is only read
+    previous_order (dict | None):
+        Previous order info
+
+    Returns
+    -------
+    tuple[dict, dict]:
+        ({language: run_translate output} of the languages that succeeded, {language: error} of the ones that failed), both in the order of dubbing_instances
+    """
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_TRANSLATION_WORKERS, len(dubbing_instances)))) as executor:
+        # each task runs in a copy of this context, so its timing spans are recorded for this request
+        futures = {
+            i.get("translation_target_language"): executor.submit(
+                contextvars.copy_context().run,
+                run_translate,
+                dubbing_instance=i,
+                data=data,
+                user=user,
+                subs_dict=subs_dict,
+                previous_order=previous_order,
+            )
+            for i in dubbing_instances
+        }
+        for language, future in futures.items():
+            try:
+                results[language] = future.result()
+            except Exception as e:
+                logging.error(f"ERROR TRANSLATING {language}: {e}")
+                errors[language] = str(e)
+
+    return results, errors
+
+def dubs(translated_subs: dict, user: USER, order_id: str, previous_order: dict | None = None):
+    azure_sentence_pause = 80
     for lang, trans in translated_subs.items():
         order_settings = trans.get("order_settings")
         print(f"ORDER SETTINGS: {order_settings}")
@@ -191,15 +378,52 @@ def dubs(translated_subs: dict, user: USER, order_id: str):
 
         print(f"TRANSLATED SUBS DICT , {order_settings}, {lang_dict}, {t_subs_dict}")
 
-        upload_files, subs_dict = synthesize_text_azure_batch(
-                    subs_dict=t_subs_dict,
-                    lang_dict=lang_dict,
-                    second_pass=False,
-                    azure_sentence_pause=80,
-                )
+        # The speed factors are predicted from the clips of earlier orders with the same voice, so most clips fit on the first pass
+        voice_key = voice_model_key(lang_dict, azure_sentence_pause)
+        predict_speed_factors(
+            t_subs_dict,
+            VoiceRateModel.from_dict(user.get_voice_rate_model(voice_key)),
+            max_overflow_ms=order_settings.get("max_overflow_milliseconds", 0),
+        )
+
+        # Clips that are identical to a clip of the previous order are copied instead of synthesized
+        hashes = synthesis_hashes(t_subs_dict, lang_dict, azure_sentence_pause)
+        previous_files = get_previous_dub_files(user, previous_order, lang)
+        reused = {
+            f"{key}.mp3": previous_files[h]
+            for key, h in zip(t_subs_dict, hashes)
+            if h in previous_files
+        }
+        # A clip that can not be copied, i.e. because it is missing from the previous order, is synthesized instead
+        copied = set()
+        if reused:
+            copied = set(user.copy_dub_clips(order_id, lang, previous_order.get("order_id"), reused))
+        to_synthesize = {key: t_subs_dict[key] for key in t_subs_dict if f"{key}.mp3" not in copied}
+        logging.debug(f"CLIPS TO SYNTHESIZE: {len(to_synthesize)} of {len(t_subs_dict)}")
+
+        upload_files = {}
+        if to_synthesize:
+            upload_files, observed = synthesize_with_rate_model(
+                        subs_dict=to_synthesize,
+                        lang_dict=lang_dict,
+                        two_pass_voice_synth=VOICE_RATE_SECOND_PASS and order_settings.get("two_pass_voice_synth", False),
+                        azure_sentence_pause=azure_sentence_pause,
+                    )
+            if observed.n:
+                user.update_voice_rate_model(voice_key, observed.to_dict())
                 
         
-        user.upload_translated_audio(data=upload_files, order_id=order_id, language=lang)
+        user.upload_translated_audio(
+            data=upload_files,
+            order_id=order_id,
+            language=lang,
+            # Only clips that are actually stored for this dub can be reused by the next order
+            manifest={
+                h: f"{key}.mp3"
+                for key, h in zip(t_subs_dict, hashes)
+                if f"{key}.mp3" in copied or f"{key}.mp3" in upload_files
+            },
+        )
 
 
 def del_temp_files(id: str):
@@ -209,6 +433,33 @@ def del_temp_files(id: str):
 
 
 
+def finish_order(response: dict, timings: Timings, user: USER | None = None) -> dict:
+    """Adds the per stage durations of the request to the response, the logs and, once the order exists, the order in db
+
+    Parameters
+    ----------
+    response (dict):
+        Endpoint response
+    timings (Timings):
+        Spans recorded while handling the request
+    user (USER | None):
+        User object, None if the user could not be authorized
+
+    Returns
+    -------
+    dict:
+        The response with a "timings" key
+    """
+    summary = timings.summary()
+    logging.debug(f"TIMINGS: {summary}")
+    if user != None and getattr(user, "order_ref", None) != None:
+        try:
+            user.set_order_timings(summary)
+        except Exception as e:
+            logging.debug(f"COULD NOT STORE TIMINGS: {e}")
+    return {**response, "timings": summary}
+
+
 #----------------------#
 #      ENDPOINTS       #
 #----------------------#
@@ -243,43 +494,41 @@ def translate_endpoint(request: Request, data: Order) -> Any:
 
     """
 
-    try:
-        logging.debug("AUTHORIZING")
-        user = authorize(request)
-    except AuthenticationError as e:
-        return {"Authentication Error": str(e)}
+    with collect_timings() as timings:
+        try:
+            logging.debug("AUTHORIZING")
+            user = authorize(request)
+        except AuthenticationError as e:
+            return finish_order({"Authentication Error": str(e)}, timings)
 
-    logging.debug("INITIALIZING DB ORDER")
-    order = user.initialize_db_order(order=data)
+        logging.debug("INITIALIZING DB ORDER")
+        order = user.initialize_db_order(order=data)
 
-    # download srt
-    try:
-        logging.debug("DOWNLOADING translation file")
-        subs_dict = get_main_srt_file(user, order)
-    except Exception as e:
-        return {"Error getting translation file": str(e)}
-
-    # run translate
-    translated_subs = {}
-    for i in order.get("dubbing_instances"):
+        # download srt
         try:
-            out = run_translate(
-                dubbing_instance=i, 
-                data=data, 
-                user=user, 
-                subs_dict=subs_dict)
-            translated_subs[i.get("translation_target_language")] = out
+            logging.debug("DOWNLOADING translation file")
+            subs_dict = get_main_srt_file(user, order)
         except Exception as e:
-            return {"Error translating": str(e)}
-    
-    # if synthesize is true, synthesize
-    # TODO: Synthesize
+            return finish_order({"Error getting translation file": str(e)}, timings, user)
+
+        previous_order = get_previous_order(user, data)
+
+        # run translate, the languages are translated concurrently and a failed language does not stop the others
+        translated_subs, errors = translate_languages(order.get("dubbing_instances"), data, user, subs_dict, previous_order)
+        if not translated_subs and errors:
+            return finish_order({"Error translating": errors}, timings, user)
+        
+        # if synthesize is true, synthesize
+        # TODO: Synthesize
 
-    print("TRANSLATED SUBS", translated_subs)
+        print("TRANSLATED SUBS", translated_subs)
 
-    dubs(translated_subs, user, order_id=data.order_id)
+        dubs(translated_subs, user, order_id=data.order_id, previous_order=previous_order)
 
-    return {"message": "success", "ordered": [i for i,j in translated_subs.items()]}
+        response = {"message": "success", "ordered": [i for i,j in translated_subs.items()]}
+        if errors:
+            response["errors"] = errors
+        return finish_order(response, timings, user)
 
 
 @app.get("/language_data/")
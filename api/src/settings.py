@@ -1,11 +1,14 @@
 from concurrent.futures import process
 from pathlib import Path
+import re
 from typing import List, Literal, Union
 from wsgiref.validate import validator
 
 import pandas as pd
 from pydantic import BaseModel, validator
 
+from subtitles import match_to_ms, ms_to_srt_time
+
 ENCODINGS = [
     {
         "CODEC": "MP3",
@@ -317,6 +320,9 @@ class Main_Settings(BaseModel):
     add_line_buffer_milliseconds: int = 30
         Adds a silence buffer between each spoken clip, but keeps the speech "centered" at the right spot so it's still synced. See notes.
 
+    max_overflow_milliseconds: int = 300
+        how far a spoken clip may run into the silence before the next subtitle before it is sped up. Set it to 0 to make every clip fit its own subtitle. See notes.
+
     debug_mode: bool = False
         If true, will print out extra debug information and save the intermediate files to the output folder.
 
@@ -324,9 +330,13 @@ class Main_Settings(BaseModel):
     ----
     `two_pass_voice_synth` if true will make it so instead of just stretching the audio clips, we will have the API generate new audio clips with adjusted speaking rates This can't be done on the first pass because we don't know how long the audio clips will be until we generate them.
 
+    The first pass already uses speed factors predicted from the clips earlier orders synthesized with the same voice, see `voice_rate_model`. Only the clips whose prediction was uncertain and that missed their duration are generated a second time, and only when the server sets VOICE_RATE_SECOND_PASS=True, because Azure bills the second pass again. Until the voice's model has enough clips nothing is predicted and every clip is generated once.
+
     `force_stretch_with_twopass` if true will stretch the second-pass clip to be exactly equal to the desired length. However, this will degrade the voice and make it sound similar to if it was just 1-Pass
 
     `add_line_buffer_milliseconds` if true will add a silence buffer between each spoken clip, but keep the speech "centered" at the right spot so it's still synced. This is useful if your subtitles file has all the beginning and end timings right up against each other (no  buffer). The total extra between clips will be 2x this (end of first + start of second). Warning: setting this too high could result in the TTS speaking extremely fast to fit into remaining clip duration. Around 25 - 50 milliseconds is a good starting point.
+
+    `max_overflow_milliseconds` lets a clip that would otherwise have to be sped up use part of the silence until the next subtitle, see `timing_planner`. The buffers of `add_line_buffer_milliseconds` are never used, so clips still don't touch.
     """
 
     skip_translation: bool = False
@@ -339,6 +349,7 @@ class Main_Settings(BaseModel):
     force_stretch_with_twopass: bool = False
     azure_sentence_pause: Union[Literal["default"], int] = 80
     add_line_buffer_milliseconds: int = 0
+    max_overflow_milliseconds: int = 300
     debug_mode: bool = False
 
     @validator("output_format")
@@ -370,6 +381,12 @@ class Main_Settings(BaseModel):
                 )
         return v
 
+    @validator("max_overflow_milliseconds")
+    def max_overflow_milliseconds_must_be_valid(cls, v):
+        if v < 0:
+            raise ValueError("max_overflow_milliseconds must be 0 or more")
+        return v
+
 
 class Dubbing_Settings(BaseModel):
     """
@@ -405,10 +422,14 @@ class Dubbing_Settings(BaseModel):
     combine_subtitles_max_chars: int = 200
         The maximum number of characters that can be combined into a single line. This is useful for services like Azure which have a character limit per line. If the combination of two adjacent subtitle lines is below this amount and one starts at the same time the other ends, then they will be combined into a single line. This should improve the speech synthesis by reducing unnatural splits in spoken sentences.
 
+    protect_with_placeholders: bool = False
+        applies to DeepL translations only - Whether to send phrases that should not be translated (dont_translate_phrases.txt, url_list.txt and manual translations) as short placeholders instead of wrapping them in notranslate tags. This reduces the characters sent and billed, especially for url heavy content.
+
     """
 
     combine_subtitles: bool = True
     combine_subtitles_max_chars: int = 200
+    protect_with_placeholders: bool = False
 
     original_language: str = "en-US"
     formality_preference: str = "default"
@@ -478,12 +499,15 @@ class Order(BaseModel):
         The dubbing settings to use
     dubbing_instances: List[Subtitle]
         A list of Subtitle objects to process
+    previous_order_id: str = ""
+        The order id of an earlier order for the same (possibly edited) srt file. Cues that did not change since that order reuse its translations and dubs instead of being sent to DeepL and Azure again
 
     """
 
     order_id: str = ""
     settings: Main_Settings = Main_Settings()
     dubbing_instances: List[Dubbing_Settings]
+    previous_order_id: str = ""
 
     @validator("settings")
     def settings_must_be_valid(cls, v):
@@ -502,86 +526,68 @@ class Order(BaseModel):
 
 
 class Srt_Timestamp:
-    """A class to represent a single SRT timestamp line.
+    """A class to represent a single SRT timestamp line. The line is parsed once and stored as integers.
 
     Attributes:
         srt_timestamps_line (str): The line of text from the SRT file that contains the start and end timestamps.
-        start (str): The start timestamp in milliseconds.
-        end (str): The end timestamp in milliseconds.
+        start_ms (int): The start timestamp in milliseconds.
+        end_ms (int): The end timestamp in milliseconds.
+        start (str): The start timestamp in SRT format.
+        end (str): The end timestamp in SRT format.
         duration (int): The duration of the timestamp in milliseconds.
 
     Methods:
-        get_start(): Returns the start timestamp in milliseconds.
-        get_end(): Returns the end timestamp in milliseconds.
+        get_start(): Returns the start timestamp in SRT format.
+        get_end(): Returns the end timestamp in SRT format.
         get_duration(): Returns the duration of the timestamp in milliseconds.
     """
 
+    __slots__ = ("srt_timestamps_line", "start_ms", "end_ms")
+
+    # As tolerant as the original validation: any number of digits per field, i.e. 0:00:20,13 --> 0:00:23,4
+    _REGEX = re.compile(
+        r"(\d+):(\d+):(\d+),(\d+)[^\S\n]+-->[^\S\n]+(\d+):(\d+):(\d+),(\d+)"
+    )
+
     def __init__(self, srt_timestamps_line):
         self.srt_timestamps_line = srt_timestamps_line
-        self.srt_timestamps_line_valid()
+        match = self._REGEX.match(srt_timestamps_line.strip())
+        if match is None:
+            raise ValueError(f"Invalid SRT timestamp line: {srt_timestamps_line}")
+        self.start_ms, self.end_ms = match_to_ms(match)
 
-        self.start = self.get_start()
-        self.end = self.get_end()
-        self.duration = self.get_duration()
+    @property
+    def start(self) -> str:
+        return ms_to_srt_time(self.start_ms)
 
-    def srt_timestamps_line_valid(self) -> bool:
-        """Validates the SRT timestamp line."""
-        from re import match
+    @property
+    def end(self) -> str:
+        return ms_to_srt_time(self.end_ms)
 
-        if (
-            match(
-                r"(\d+:\d+:\d+,\d+)[^\S\n]+-->[^\S\n]+(\d+:\d+:\d+,\d+)",
-                self.srt_timestamps_line,
-            )
-            is not None
-        ):
-            return True
-        else:
-            raise ValueError(f"Invalid SRT timestamp line: {self.srt_timestamps_line}")
+    @property
+    def duration(self) -> int:
+        return self.end_ms - self.start_ms
+
+    def srt_timestamps_line_valid(self) -> bool:
+        """Validates the SRT timestamp line. Lines are validated when parsed, so this is always True"""
+        return True
 
     def get_start(self) -> str:
-        start_ms = self.srt_timestamps_line.split(" --> ")[0]
-        return start_ms
+        return self.start
 
     def get_end(self) -> str:
-        end_ms = self.srt_timestamps_line.split(" --> ")[1]
-        return end_ms
+        return self.end
 
     def get_duration(self) -> int:
-        # convert start and end to int in milliseconds
-        start_ms = (
-            int(self.start.split(":")[0]) * 3600000
-            + int(self.start.split(":")[1]) * 60000
-            + int(self.start.split(":")[2].split(",")[0]) * 1000
-            + int(self.start.split(":")[2].split(",")[1])
-        )
-        end_ms = (
-            int(self.end.split(":")[0]) * 3600000
-            + int(self.end.split(":")[1]) * 60000
-            + int(self.end.split(":")[2].split(",")[0]) * 1000
-            + int(self.end.split(":")[2].split(",")[1])
-        )
-
-        duration_ms = end_ms - start_ms
-        return duration_ms
+        return self.duration
 
     def __repr__(self) -> str:
         return f"{self.start} --> {self.end}"
 
     def __eq__(self, other) -> bool:
         if isinstance(other, Srt_Timestamp):
-            return (
-                self.start == other.start
-                and self.end == other.end
-                and self.duration == other.duration
-            )
+            return self.start_ms == other.start_ms and self.end_ms == other.end_ms
         return False
 
     def __ne__(self, other) -> bool:
-        if isinstance(other, Srt_Timestamp):
-            return (
-                self.start != other.start
-                or self.end != other.end
-                or self.duration != other.duration
-            )
-        return True
+        return not self == other
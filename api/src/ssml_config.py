@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from sys import stdout
+from typing import Any, Callable, Hashable, Iterable
+
+from utils import csv_to_dict, txt_to_list
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=stdout,
+)
+
+SSML_CUSTOMIZATION_DIR = os.environ.get(
+    "SSML_CUSTOMIZATION_DIR", os.path.abspath("SSML_Customization")
+)
+
+# Minimum number of seconds between two mtime checks of the same file
+SSML_CONFIG_CHECK_INTERVAL = float(os.environ.get("SSML_CONFIG_CHECK_INTERVAL", "2"))
+
+# name -> (file name in SSML_CUSTOMIZATION_DIR, parser)
+SSML_FILES = {
+    "dont_translate_phrases": ("dont_translate_phrases.txt", txt_to_list),
+    "url_list": ("url_list.txt", txt_to_list),
+    "manual_translations": ("Manual_Translations.csv", csv_to_dict),
+    "interpret_as": ("interpret-as.csv", csv_to_dict),
+    "aliases": ("aliases.csv", csv_to_dict),
+    "phonemes": ("Phoneme_Pronunciation.csv", csv_to_dict),
+}
+
+
+class _ConfigFile:
+    """A parsed config file, reparsed only when its mtime or size changes"""
+
+    def __init__(self, path: str, parser: Callable[[str], Any]):
+        self.path = path
+        self.parser = parser
+        self.value: Any = None
+        self.version = ""
+        self._stat = None
+        self._checked = 0.0
+
+    def refresh(self, check_interval: float) -> None:
+        now = time.monotonic()
+        if self._stat != None and now - self._checked < check_interval:
+            return
+        self._checked = now
+
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if self._stat == None:
+                raise
+            # keep serving the last good version, i.e. while the file is being replaced
+            logging.debug(f"COULD NOT STAT {self.path}, KEEPING LOADED VERSION: {e}")
+            return
+
+        stat = (st.st_mtime_ns, st.st_size)
+        if stat == self._stat:
+            return
+
+        logging.debug(f"LOADING SSML CONFIG FILE: {self.path}")
+        with open(self.path, "rb") as f:
+            version = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+        self.value = self.parser(self.path)
+        self.version = version
+        self._stat = stat
+
+
+class SSMLConfigRegistry:
+    """
+    Loads the SSML_Customization files once and shares them between modules. A file is reparsed only when its mtime or size changes, checked at most every `check_interval` seconds, so edits take effect without a restart.
+
+    Values derived from the files, i.e. compiled regexes, are cached with `derived` and rebuilt when a file they depend on changes.
+
+    Parameters
+    ----------
+    directory: str
+        the SSML_Customization folder
+    files: dict
+        {name: (file name, parser)}
+    check_interval: float
+        minimum number of seconds between two mtime checks of the same file
+    """
+
+    def __init__(self, directory: str, files: dict, check_interval: float = SSML_CONFIG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._files = {
+            name: _ConfigFile(os.path.join(directory, fileName), parser)
+            for name, (fileName, parser) in files.items()
+        }
+        self._derived: dict = {}
+        self._lock = threading.RLock()
+
+    def _file(self, name: str) -> _ConfigFile:
+        configFile = self._files[name]
+        with self._lock:
+            configFile.refresh(self.check_interval)
+        return configFile
+
+    def get(self, name: str) -> Any:
+        """Returns the parsed contents of a file, see `SSML_FILES`. Do not modify the returned value, it is shared"""
+        return self._file(name).value
+
+    def version(self, name: str) -> str:
+        """Returns a hash of the current contents of a file"""
+        return self._file(name).version
+
+    def versions(self, names: Iterable[str]) -> tuple:
+        """Returns the content hashes of several files, i.e. to key caches on the config they were built from"""
+        return tuple(self.version(name) for name in names)
+
+    def derived(self, key: Hashable, names: Iterable[str], build: Callable[[], Any]) -> Any:
+        """
+        Returns a value built from some of the files, building it only when one of them changed
+
+        Parameters
+        ----------
+        key: Hashable
+            identifies the value, i.e. ("notranslate_regex", "DE")
+        names: Iterable[str]
+            the files the value is built from
+        build: Callable
+            builds the value, called without arguments
+        """
+        versions = self.versions(names)
+        with self._lock:
+            cached = self._derived.get(key)
+            if cached != None and cached[0] == versions:
+                return cached[1]
+        value = build()
+        with self._lock:
+            self._derived[key] = (versions, value)
+        return value
+
+
+SSML_CONFIG = SSMLConfigRegistry(SSML_CUSTOMIZATION_DIR, SSML_FILES)
@@ -0,0 +1,221 @@
+import heapq
+from collections.abc import Mapping
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from subtitles import SubtitleTrack
+
+
+def _char_rate(length: int, duration_ms: int) -> float:
+    """Characters per second, rounded like `speaking_rates`"""
+    return round(length / (int(duration_ms) / 1000), 2)
+
+
+def _char_rate_diff(charRate: float, charRateGoal: float) -> float:
+    return abs(round(charRate - charRateGoal, 2))
+
+
+def round2(values: np.ndarray) -> np.ndarray:
+    """Rounds to 2 decimals like the builtin `round`. `np.round` scales by 100 first, which can round the other way for values within an ulp of a half, those few are rounded one by one"""
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    suspect = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in suspect.tolist():
+        rounded[i] = round(float(values[i]), 2)
+    return rounded
+
+
+def speaking_rates(
+    lengths,
+    durations_ms,
+    charRateGoal: float = 20,
+    positions: Optional[Sequence[int]] = None,
+    out: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes char_rate (characters per second, rounded to 2 decimals) and char_rate_diff (its absolute distance to the goal) for many cues in one vectorized step. The values are the same as the ones of `translate_utils.calc_list_speaking_rates`
+
+    Parameters
+    ----------
+    lengths: array like
+        text length of every cue
+    durations_ms: array like
+        duration of every cue in milliseconds
+    charRateGoal: float
+        the speaking rate to aim for, in characters per second
+    positions: Sequence[int] | None
+        only compute these cues, i.e. the ones a merge touched. Requires `out`
+    out: (np.ndarray, np.ndarray) | None
+        (char_rate, char_rate_diff) arrays to update in place
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        char_rate and char_rate_diff
+    """
+    lengths = np.asarray(lengths, dtype=np.float64)
+    durations = np.asarray(durations_ms, dtype=np.float64)
+    if positions is not None:
+        if out is None:
+            raise ValueError("out is required to update positions")
+        positions = np.asarray(positions, dtype=np.int64)
+        lengths, durations = lengths[positions], durations[positions]
+
+    with np.errstate(divide="raise", invalid="raise"):
+        rate = round2(lengths / (durations / 1000))
+    diff = np.abs(round2(rate - charRateGoal))
+
+    if out is None:
+        return rate, diff
+    if positions is None:
+        out[0][:] = rate
+        out[1][:] = diff
+    else:
+        out[0][positions] = rate
+        out[1][positions] = diff
+    return out
+
+
+def combine_subtitles_heap(
+    subs_dict: Union[SubtitleTrack, Mapping],
+    charRateGoal: float = 20,
+    gapThreshold: int = 100,
+    maxCharacters: int = 200,
+) -> SubtitleTrack:
+    """
+    Combines subtitle lines that are close together and have a similar speaking rate, making the same merges as repeatedly calling `translate_utils.combine_single_pass` in O(n log n).
+
+    The legacy loop always merges the cue with the largest `char_rate_diff` (the earliest cue on ties) that has a valid neighbour, then starts over. A merge only changes the merged cue and what its two neighbours see, so every other cue that could not merge still cannot. Here the cues are kept in a heap keyed on (-char_rate_diff, position) with a doubly linked list of neighbours: a popped cue that cannot merge is dropped until one of its neighbours changes, and the entries of changed cues are invalidated lazily with a version number.
+
+    Parameters
+    ----------
+    subs_dict: SubtitleTrack | Mapping
+        the translated subtitles, they are not modified
+    charRateGoal: float
+        the speaking rate to aim for, in characters per second
+    gapThreshold: int
+        the maximum gap in milliseconds between two subtitles to combine
+    maxCharacters: int
+        the maximum length of a combined translated text
+
+    Returns
+    -------
+    SubtitleTrack
+        the combined track, numbered from 1. Like the legacy version every cue also gets `originalIndex`, `char_rate` and `char_rate_diff` fields
+    """
+    track = subs_dict if isinstance(subs_dict, SubtitleTrack) else SubtitleTrack.from_dict(subs_dict)
+    n = len(track)
+
+    start = track.start_ms.tolist()
+    end = track.end_ms.tolist()
+    gap = track.break_until_next.tolist()
+    text = list(track.text)
+    lines = [track.srt_timestamps_line(i) for i in range(n)]
+    if track.translated_text is None and n:
+        raise ValueError("The subtitles must be translated before they are combined")
+    translated = list(track.translated_text or [])
+    length = [len(t) for t in translated]
+    rateArray, diffArray = speaking_rates(length, track.duration_ms, charRateGoal)
+    rate = rateArray.tolist()
+
+    # Doubly linked list over the positions of the input, -1 marks the ends
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    if n:
+        nxt[-1] = -1
+    alive = [True] * n
+    version = [0] * n
+
+    def merge_partner(i) -> Optional[tuple]:
+        """Returns the (left, right) pair cue i would be merged into by the legacy pass, None if it can not be merged. The checks mirror `combine_single_pass`, including its quirks"""
+        r = rate[i]
+        p, q = prev[i], nxt[i]
+        if r > charRateGoal:
+            # The legacy check `or nextDiff` only lets the next cue through when its rate is exactly equal
+            if (
+                q != -1
+                and r - rate[q] == 0
+                and gap[i] < gapThreshold
+                and length[i] + length[q] <= maxCharacters
+            ):
+                return i, q
+            if (
+                p != -1
+                and r - rate[p] > 0
+                and gap[p] < gapThreshold
+                and length[p] + length[i] <= maxCharacters
+            ):
+                return p, i
+            return None
+
+        if r < charRateGoal:
+            considerNext = (
+                q != -1
+                and r - rate[q] < 0
+                and gap[i] < gapThreshold
+                and length[i] + length[q] <= maxCharacters
+            )
+            considerPrev = (
+                p != -1
+                and r - rate[p] < 0
+                and gap[p] < gapThreshold
+                and length[p] + length[i] <= maxCharacters
+            )
+            if considerNext and considerPrev:
+                return (i, q) if r - rate[q] > r - rate[p] else (p, i)
+            if considerNext:
+                return i, q
+            if considerPrev:
+                return p, i
+        return None
+
+    heap = [(-diff, i, 0) for i, diff in enumerate(diffArray.tolist())]
+    heapq.heapify(heap)
+
+    while heap:
+        _, i, v = heapq.heappop(heap)
+        if not alive[i] or v != version[i]:
+            continue
+        pair = merge_partner(i)
+        if pair is None:
+            continue
+
+        # The left cue absorbs the right one and keeps its own break_until_next, like the legacy merge
+        a, b = pair
+        text[a] = text[a] + " " + text[b]
+        translated[a] = translated[a] + " " + translated[b]
+        length[a] = len(translated[a])
+        end[a] = end[b]
+        lines[a] = lines[a].split(" --> ")[0] + " --> " + lines[b].split(" --> ")[1]
+        rate[a] = _char_rate(length[a], end[a] - start[a])
+        alive[b] = False
+        nxt[a] = nxt[b]
+        if nxt[b] != -1:
+            prev[nxt[b]] = a
+
+        for j in (a, prev[a], nxt[a]):
+            if j != -1:
+                version[j] += 1
+                heapq.heappush(heap, (-_char_rate_diff(rate[j], charRateGoal), j, version[j]))
+
+    keep = [i for i in range(n) if alive[i]]
+    extras = {key: [column[i] for i in keep] for key, column in track.extras.items()}
+    extras["originalIndex"] = list(range(len(keep)))
+    rateArray, diffArray = speaking_rates(
+        [length[i] for i in keep], [end[i] - start[i] for i in keep], charRateGoal
+    )
+    extras["char_rate"] = rateArray.tolist()
+    extras["char_rate_diff"] = diffArray.tolist()
+
+    return SubtitleTrack(
+        range(1, len(keep) + 1),
+        [start[i] for i in keep],
+        [end[i] for i in keep],
+        [text[i] for i in keep],
+        break_until_next=[gap[i] for i in keep],
+        translated_text=[translated[i] for i in keep],
+        buffer_ms=track.buffer_ms,
+        extras=extras,
+        timestamp_lines=[lines[i] for i in keep],
+    )
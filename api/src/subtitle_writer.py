@@ -0,0 +1,196 @@
+import re
+from collections.abc import Mapping
+from typing import IO, Iterator, Union
+
+import numpy as np
+
+from subtitles import SubtitleTrack
+
+# Number of cues rendered into each chunk by `iter_subtitle_chunks`
+CHUNK_CUES = 1000
+
+SUBTITLE_FORMATS = {
+    "srt": {"content_type": "application/x-subrip", "encoding": "utf-8-sig"},
+    "vtt": {"content_type": "text/vtt", "encoding": "utf-8"},
+    "ass": {"content_type": "text/x-ssa", "encoding": "utf-8-sig"},
+}
+
+ASS_HEADER = (
+    "[Script Info]\n"
+    "ScriptType: v4.00+\n"
+    "WrapStyle: 0\n"
+    "ScaledBorderAndShadow: yes\n"
+    "PlayResX: 1920\n"
+    "PlayResY: 1080\n"
+    "\n"
+    "[V4+ Styles]\n"
+    "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n"
+    "Style: Default,Arial,64,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,1,2,60,60,50,1\n"
+    "\n"
+    "[Events]\n"
+    "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+)
+
+# The cue text tags WebVTT allows, i.e. <i>, </b> or <c.yellow>. They are written as is, any other < > or & is escaped
+VTT_TAG_REGEX = re.compile(r"(?P<tag></?(?:[ibuc]|ruby|rt|v|lang)(?:[.\s][^<>&]*)?>)|(?P<char>[&<>])")
+_VTT_ESCAPES = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}
+# Braces start override blocks in ASS, escaped they are shown as text
+_ASS_ESCAPES = str.maketrans({"{": "\\{", "}": "\\}", "\n": "\\N"})
+
+
+def _escape_vtt(text: str) -> str:
+    return VTT_TAG_REGEX.sub(lambda match: match.group("tag") or _VTT_ESCAPES[match.group("char")], text)
+
+
+def _split_times(times: np.ndarray) -> tuple:
+    """Splits an array of milliseconds into lists of hours, minutes, seconds and milliseconds"""
+    return (
+        (times // 3600000).tolist(),
+        (times // 60000 % 60).tolist(),
+        (times // 1000 % 60).tolist(),
+        (times % 1000).tolist(),
+    )
+
+
+def _render_srt(numbers, starts, ends, texts, lines=None) -> Iterator[str]:
+    sh, sm, ss, sms = starts
+    eh, em, es, ems = ends
+    for i, text in enumerate(texts):
+        # The timestamps line of the source file is kept as it was read, see `SubtitleTrack.srt_timestamps_line`
+        if lines is not None:
+            yield f"{numbers[i]}\n{lines[i]}\n{text}\n\n"
+            continue
+        yield (
+            f"{numbers[i]}\n"
+            f"{sh[i]:02d}:{sm[i]:02d}:{ss[i]:02d},{sms[i]:03d} --> {eh[i]:02d}:{em[i]:02d}:{es[i]:02d},{ems[i]:03d}\n"
+            f"{text}\n\n"
+        )
+
+
+def _render_vtt(numbers, starts, ends, texts, lines=None) -> Iterator[str]:
+    sh, sm, ss, sms = starts
+    eh, em, es, ems = ends
+    for i, text in enumerate(texts):
+        text = _escape_vtt(text)
+        yield (
+            f"{numbers[i]}\n"
+            f"{sh[i]:02d}:{sm[i]:02d}:{ss[i]:02d}.{sms[i]:03d} --> {eh[i]:02d}:{em[i]:02d}:{es[i]:02d}.{ems[i]:03d}\n"
+            f"{text}\n\n"
+        )
+
+
+def _render_ass(numbers, starts, ends, texts, lines=None) -> Iterator[str]:
+    sh, sm, ss, sms = starts
+    eh, em, es, ems = ends
+    for i, text in enumerate(texts):
+        text = text.translate(_ASS_ESCAPES)
+        yield (
+            f"Dialogue: 0,{sh[i]}:{sm[i]:02d}:{ss[i]:02d}.{sms[i] // 10:02d},{eh[i]}:{em[i]:02d}:{es[i]:02d}.{ems[i] // 10:02d},Default,,0,0,0,,{text}\n"
+        )
+
+
+_RENDERERS = {"srt": _render_srt, "vtt": _render_vtt, "ass": _render_ass}
+_HEADERS = {"srt": "", "vtt": "WEBVTT\n\n", "ass": ASS_HEADER}
+
+
+def iter_subtitle_chunks(
+    subs_dict: Union[SubtitleTrack, Mapping],
+    fmt: str = "srt",
+    text_field: str = "translated_text",
+    chunk_cues: int = CHUNK_CUES,
+) -> Iterator[str]:
+    """Renders a subtitle track to a subtitle file, yielding it in chunks of `chunk_cues` cues
+
+    Parameters
+    ----------
+    subs_dict: SubtitleTrack | Mapping
+        the subtitles to render, a plain subtitles dictionary is accepted as well
+    fmt: { "srt", "vtt", "ass" } = "srt"
+        the subtitle format
+    text_field: { "translated_text", "text" } = "translated_text"
+        which text to write. Falls back to "text" if the track is not translated
+    chunk_cues: int
+        number of cues per yielded chunk
+
+    Yields
+    ------
+    str
+        the rendered file, in order
+    """
+    if fmt not in _RENDERERS:
+        raise ValueError(f"fmt must be one of: {', '.join(_RENDERERS)}")
+
+    track = subs_dict if isinstance(subs_dict, SubtitleTrack) else SubtitleTrack.from_dict(subs_dict)
+    texts = track.translated_text if text_field == "translated_text" and track.translated_text is not None else track.text
+
+    # Subtitle files get the unbuffered times, the same as `srt_timestamps_line`
+    starts = _split_times(track.start_ms - track.buffer_ms)
+    ends = _split_times(track.end_ms + track.buffer_ms)
+    numbers = track.numbers.tolist()
+    lines = None
+    if fmt == "srt" and track.timestamp_lines is not None:
+        lines = [track.srt_timestamps_line(i) for i in range(len(track))]
+    render = _RENDERERS[fmt]
+
+    if _HEADERS[fmt]:
+        yield _HEADERS[fmt]
+    for x in range(0, len(track), chunk_cues):
+        chunk = slice(x, x + chunk_cues)
+        yield "".join(
+            render(
+                numbers[chunk],
+                [part[chunk] for part in starts],
+                [part[chunk] for part in ends],
+                texts[chunk],
+                None if lines is None else lines[chunk],
+            )
+        )
+
+
+def render_subtitles(subs_dict, fmt: str = "srt", text_field: str = "translated_text") -> str:
+    """Renders a subtitle track to a subtitle file in a single buffer. See `iter_subtitle_chunks`"""
+    return "".join(iter_subtitle_chunks(subs_dict, fmt, text_field))
+
+
+def write_subtitles(
+    subs_dict, dst: Union[str, IO[bytes]], fmt: str = "srt", text_field: str = "translated_text"
+) -> None:
+    """Writes a subtitle track to a file path or a binary file object chunk by chunk. See `iter_subtitle_chunks`
+
+    Parameters
+    ----------
+    subs_dict: SubtitleTrack | Mapping
+        the subtitles to write
+    dst: str | IO[bytes]
+        the destination file path or binary file object, i.e. a `Blob.open("wb")` writer
+    fmt: { "srt", "vtt", "ass" } = "srt"
+        the subtitle format
+    """
+    encoding = SUBTITLE_FORMATS[fmt]["encoding"]
+    if isinstance(dst, str):
+        with open(dst, "w", encoding=encoding) as f:
+            for chunk in iter_subtitle_chunks(subs_dict, fmt, text_field):
+                f.write(chunk)
+        return
+
+    # Encode the BOM once, not per chunk
+    if encoding == "utf-8-sig":
+        dst.write(b"\xef\xbb\xbf")
+    for chunk in iter_subtitle_chunks(subs_dict, fmt, text_field):
+        dst.write(chunk.encode("utf-8"))
+
+
+def upload_subtitles(blob, subs_dict, fmt: str = "srt", text_field: str = "translated_text") -> None:
+    """Streams a rendered subtitle track into a storage blob, without a temp file
+
+    Parameters
+    ----------
+    blob: google.cloud.storage.Blob
+        the destination blob
+    subs_dict: SubtitleTrack | Mapping
+        the subtitles to upload
+    fmt: { "srt", "vtt", "ass" } = "srt"
+        the subtitle format
+    """
+    with blob.open("wb", content_type=SUBTITLE_FORMATS[fmt]["content_type"]) as f:
+        write_subtitles(subs_dict, f, fmt, text_field)
@@ -0,0 +1,575 @@
+import codecs
+import hashlib
+import io
+import re
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, Union
+
+import numpy as np
+
+# Matches the following example with regex:    00:00:20,130 --> 00:00:23,419
+# Hours may be written with one or two digits, i.e. 0:00:20,130 or 00:00:20,130
+SRT_TIMESTAMP_LINE_REGEX = re.compile(
+    r"(\d{1,2}):(\d\d):(\d\d),(\d\d\d)[^\S\n]+-->[^\S\n]+(\d{1,2}):(\d\d):(\d\d),(\d\d\d)"
+)
+
+
+class SrtCue(NamedTuple):
+    """A single cue parsed from an srt file
+
+    Attributes
+    ----------
+    number: int
+        the srt line number
+    start_ms: int
+        start time in milliseconds
+    end_ms: int
+        end time in milliseconds
+    text: str
+        the text of the subtitle, multi-line text is joined with a single space
+    srt_timestamps_line: str
+        the srt formatted timestamps i.e. '00:00:03,400 --> 00:00:06,177'
+    """
+
+    number: int
+    start_ms: int
+    end_ms: int
+    text: str
+    srt_timestamps_line: str
+
+
+def ms_to_srt_time(ms: int) -> str:
+    """Formats milliseconds as an srt timestamp i.e. 3400 -> '00:00:03,400'"""
+    ms = int(ms)
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def match_to_ms(match: re.Match) -> tuple:
+    """Converts a match of `SRT_TIMESTAMP_LINE_REGEX` to (start_ms, end_ms)"""
+    h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, match.groups())
+    return (
+        h1 * 3600000 + m1 * 60000 + s1 * 1000 + ms1,
+        h2 * 3600000 + m2 * 60000 + s2 * 1000 + ms2,
+    )
+
+
+def iter_chunk_lines(chunks: Iterable[bytes], encoding: str = "utf-8-sig") -> Iterator[str]:
+    """
+    Splits a stream of byte chunks, i.e. `requests.Response.iter_content`, into decoded lines. Only the current partial line is held in memory, and multi-byte characters split across chunks are handled.
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        the raw chunks
+    encoding : str
+        the encoding of the stream, by default "utf-8-sig" which drops a leading BOM
+
+    Yields
+    ------
+    str
+        the lines without the trailing newline
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        if "\n" not in pending:
+            continue
+        lines = pending.split("\n")
+        pending = lines.pop()
+        yield from lines
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_srt_cues(lines: Iterable[Union[str, bytes]]) -> Iterator[SrtCue]:
+    """
+    Parses srt lines into cues in a single pass. Works on any iterable of lines, so a file object, a list of lines or a streamed response can be passed directly without reading the whole file first.
+
+    Parameters
+    ----------
+    lines : Iterable[str | bytes]
+        lines of an srt file, bytes are decoded as utf-8. A leading BOM is ignored
+
+    Yields
+    ------
+    SrtCue
+        the parsed cues in file order
+    """
+    number: Optional[str] = None
+    timestamps: Optional[re.Match] = None
+    textLines: list = []
+    firstLine = True
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if firstLine:
+            line = line.lstrip("\ufeff")
+            firstLine = False
+        line = line.strip()
+
+        # Collecting the text of a cue, a blank line ends the cue
+        if timestamps is not None:
+            if line:
+                textLines.append(line)
+                continue
+            yield SrtCue(int(number), *match_to_ms(timestamps), " ".join(textLines), timestamps.string)  # type: ignore
+            number, timestamps, textLines = None, None, []
+
+        # A line with only an integer followed by a timestamps line starts a cue
+        elif number is not None and (match := SRT_TIMESTAMP_LINE_REGEX.match(line)):
+            timestamps = match
+        else:
+            number = line if line.isdigit() else None
+
+    # The file may not end with a blank line
+    if timestamps is not None:
+        yield SrtCue(int(number), *match_to_ms(timestamps), " ".join(textLines), timestamps.string)  # type: ignore
+
+
+# Missing value marker for the optional per cue fields stored in `SubtitleTrack.extras`
+_MISSING = object()
+
+# Cue fields backed by the integer arrays of a `SubtitleTrack`. The buffered variants are kept for old callers, the buffer is already applied to the main values
+_TIME_FIELDS = {
+    "start_ms": "start_ms",
+    "start_ms_buffered": "start_ms",
+    "end_ms": "end_ms",
+    "end_ms_buffered": "end_ms",
+    "break_until_next": "break_until_next",
+}
+_CORE_FIELDS = (
+    "start_ms",
+    "end_ms",
+    "duration_ms",
+    "text",
+    "break_until_next",
+    "srt_timestamps_line",
+    "start_ms_buffered",
+    "end_ms_buffered",
+    "duration_ms_buffered",
+)
+
+
+# Bumped whenever the layout written by `SubtitleTrack.to_bytes` changes
+TRACK_ARTIFACT_VERSION = 2
+
+
+def _pack_texts(texts: list) -> tuple:
+    """Packs a list of strings into (utf-8 buffer, end offsets)"""
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.cumsum([len(text) for text in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_texts(buffer: np.ndarray, offsets: np.ndarray) -> list:
+    """Inverse of `_pack_texts`"""
+    data = buffer.tobytes()
+    starts = [0] + offsets[:-1].tolist()
+    return [data[a:b].decode("utf-8") for a, b in zip(starts, offsets.tolist())]
+
+
+class Cue(MutableMapping):
+    """A dict compatible view of a single cue of a `SubtitleTrack`. Reads and writes go straight to the track's columns, so `subs_dict[key]["start_ms"]` keeps working for old callers. Values are integers, not strings.
+
+    Fields other than the ones listed in `utils.srt_to_dict` (i.e. 'translated_text' or 'speed_factor') are stored in the track as well.
+    """
+
+    __slots__ = ("_track", "_i")
+
+    def __init__(self, track: "SubtitleTrack", i: int):
+        self._track = track
+        self._i = i
+
+    def __getitem__(self, key: str) -> Any:
+        track, i = self._track, self._i
+        if key in _TIME_FIELDS:
+            return int(getattr(track, _TIME_FIELDS[key])[i])
+        if key in ("duration_ms", "duration_ms_buffered"):
+            return int(track.end_ms[i] - track.start_ms[i])
+        if key == "text":
+            return track.text[i]
+        if key == "srt_timestamps_line":
+            return track.srt_timestamps_line(i)
+        if key == "translated_text" and track.translated_text is not None:
+            return track.translated_text[i]
+        column = track.extras.get(key)
+        if column is None or column[i] is _MISSING:
+            raise KeyError(key)
+        return column[i]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        track, i = self._track, self._i
+        if key in _TIME_FIELDS or key in ("duration_ms", "duration_ms_buffered", "srt_timestamps_line"):
+            track._index = None
+        if key in _TIME_FIELDS:
+            getattr(track, _TIME_FIELDS[key])[i] = int(value)
+        elif key in ("duration_ms", "duration_ms_buffered"):
+            track.end_ms[i] = track.start_ms[i] + int(value)
+        elif key == "text":
+            track.text[i] = value
+        elif key == "srt_timestamps_line":
+            match = SRT_TIMESTAMP_LINE_REGEX.match(value)
+            if match is None:
+                raise ValueError(f"Invalid SRT timestamp line: {value}")
+            start, end = match_to_ms(match)
+            track.start_ms[i] = start + track.buffer_ms
+            track.end_ms[i] = end - track.buffer_ms
+            if track.timestamp_lines is None:
+                track.timestamp_lines = [None] * len(track)
+            track.timestamp_lines[i] = value
+        elif key == "translated_text":
+            if track.translated_text is None:
+                track.translated_text = [None] * len(track)
+            track.translated_text[i] = value
+        else:
+            track.extras.setdefault(key, [_MISSING] * len(track))[i] = value
+
+    def __delitem__(self, key: str) -> None:
+        track, i = self._track, self._i
+        if key == "translated_text" and track.translated_text is not None:
+            track.translated_text[i] = None
+            return
+        column = track.extras.get(key)
+        if column is None or column[i] is _MISSING:
+            raise KeyError(key)
+        column[i] = _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        track, i = self._track, self._i
+        yield from _CORE_FIELDS
+        if track.translated_text is not None and track.translated_text[i] is not None:
+            yield "translated_text"
+        for key, column in track.extras.items():
+            if column[i] is not _MISSING:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class SubtitleTrack(Mapping):
+    """A columnar, integer typed store for the cues of a subtitle file.
+
+    Timings are stored as NumPy integer arrays and texts as lists, so timing math can be done on whole tracks at once. The track is also a read only mapping of `str(number) -> Cue`, a dict compatible view of each cue with the same keys as the dictionary from `utils.srt_to_dict`.
+
+    Attributes
+    ----------
+    numbers: np.ndarray
+        the srt line numbers
+    start_ms: np.ndarray
+        start times in milliseconds, with the buffer applied
+    end_ms: np.ndarray
+        end times in milliseconds, with the buffer applied
+    break_until_next: np.ndarray
+        number of milliseconds until the next subtitle, 0 for the last one. Measured on the unbuffered times
+    text: list
+        the text of each subtitle
+    translated_text: list | None
+        the translated text of each subtitle, None until the track is translated
+    timestamp_lines: list | None
+        the timestamps line of each subtitle as it was read, None for a cue without one. See `srt_timestamps_line`
+    buffer_ms: int
+        the buffer added to the start and subtracted from the end of each subtitle
+    extras: dict
+        any other per cue fields set through the `Cue` views, {field: [value per cue]}
+    """
+
+    __slots__ = (
+        "numbers",
+        "start_ms",
+        "end_ms",
+        "break_until_next",
+        "text",
+        "translated_text",
+        "timestamp_lines",
+        "buffer_ms",
+        "extras",
+        "_positions",
+        "_index",
+    )
+
+    def __init__(
+        self,
+        numbers,
+        start_ms,
+        end_ms,
+        text: list,
+        break_until_next=None,
+        translated_text: Optional[list] = None,
+        buffer_ms: int = 0,
+        extras: Optional[dict] = None,
+        timestamp_lines: Optional[list] = None,
+    ):
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self.start_ms = np.asarray(start_ms, dtype=np.int64)
+        self.end_ms = np.asarray(end_ms, dtype=np.int64)
+        self.text = list(text)
+        self.translated_text = None if translated_text is None else list(translated_text)
+        self.timestamp_lines = None if timestamp_lines is None else list(timestamp_lines)
+        self.buffer_ms = int(buffer_ms)
+        self.extras = {} if extras is None else extras
+        self._positions: Optional[dict] = None
+        self._index: Optional[IntervalIndex] = None
+
+        if break_until_next is None:
+            break_until_next = np.zeros(len(self.numbers), dtype=np.int64)
+            # Gap between the unbuffered times, i.e. (start[i+1] - buffer) - (end[i] + buffer)
+            break_until_next[:-1] = self.start_ms[1:] - self.end_ms[:-1] - 2 * self.buffer_ms
+        self.break_until_next = np.asarray(break_until_next, dtype=np.int64)
+
+    @classmethod
+    def from_cues(cls, cues: Iterable[SrtCue], addBufferMilliseconds: int = 0) -> "SubtitleTrack":
+        """Builds a track from parsed cues, i.e. from `iter_srt_cues`
+
+        Parameters
+        ----------
+        cues : Iterable[SrtCue]
+            the parsed cues
+        addBufferMilliseconds : int
+            number of milliseconds to add to the start and subtract from the end of each srt line
+        """
+        buffer = addBufferMilliseconds if addBufferMilliseconds and addBufferMilliseconds > 0 else 0
+        numbers, starts, ends, texts, lines = [], [], [], [], []
+        for cue in cues:
+            numbers.append(cue.number)
+            starts.append(cue.start_ms)
+            ends.append(cue.end_ms)
+            texts.append(cue.text)
+            lines.append(cue.srt_timestamps_line)
+
+        start_ms = np.array(starts, dtype=np.int64) + buffer
+        end_ms = np.array(ends, dtype=np.int64) - buffer
+        return cls(numbers, start_ms, end_ms, texts, buffer_ms=buffer, timestamp_lines=lines)
+
+    @classmethod
+    def from_srt(cls, lines: Iterable[Union[str, bytes]], addBufferMilliseconds: int = 0) -> "SubtitleTrack":
+        """Parses srt lines into a track in a single pass. See `iter_srt_cues`"""
+        return cls.from_cues(iter_srt_cues(lines), addBufferMilliseconds)
+
+    @classmethod
+    def from_dict(cls, subs_dict: Mapping) -> "SubtitleTrack":
+        """Builds a track from a subtitles dictionary with the structure from `utils.srt_to_dict`. String or integer values are accepted. Unknown fields are kept in `extras`"""
+        if isinstance(subs_dict, SubtitleTrack):
+            return subs_dict.copy()
+
+        values = list(subs_dict.values())
+        n = len(values)
+        numbers = np.fromiter((int(key) for key in subs_dict), dtype=np.int64, count=n)
+        start_ms = np.fromiter((int(value["start_ms"]) for value in values), dtype=np.int64, count=n)
+        end_ms = np.fromiter((int(value["end_ms"]) for value in values), dtype=np.int64, count=n)
+        break_until_next = np.fromiter((int(value.get("break_until_next") or 0) for value in values), dtype=np.int64, count=n)
+
+        # Recover the buffer from the unbuffered timestamps line
+        buffer_ms = 0
+        if n and values[0].get("srt_timestamps_line"):
+            match = SRT_TIMESTAMP_LINE_REGEX.match(values[0]["srt_timestamps_line"])
+            if match is not None:
+                buffer_ms = int(start_ms[0]) - match_to_ms(match)[0]
+
+        translated_text = None
+        if any("translated_text" in value for value in values):
+            translated_text = [value.get("translated_text") for value in values]
+
+        timestamp_lines = None
+        if any(value.get("srt_timestamps_line") for value in values):
+            timestamp_lines = [value.get("srt_timestamps_line") or None for value in values]
+
+        extras: dict = {}
+        for i, value in enumerate(values):
+            for key in value.keys() - _CORE_FIELDS - {"translated_text"}:
+                extras.setdefault(key, [_MISSING] * n)[i] = value[key]
+
+        return cls(
+            numbers,
+            start_ms,
+            end_ms,
+            [value["text"] for value in values],
+            break_until_next=break_until_next,
+            translated_text=translated_text,
+            buffer_ms=buffer_ms,
+            extras=extras,
+            timestamp_lines=timestamp_lines,
+        )
+
+    def to_dict(self) -> dict:
+        """Returns the track as a plain (JSON serializable) subtitles dictionary, see `utils.srt_to_dict`"""
+        return {key: dict(cue) for key, cue in self.items()}
+
+    def copy(self) -> "SubtitleTrack":
+        """Returns a copy of the track. The arrays and lists are copied, the strings are shared"""
+        return SubtitleTrack(
+            self.numbers.copy(),
+            self.start_ms.copy(),
+            self.end_ms.copy(),
+            self.text,
+            break_until_next=self.break_until_next.copy(),
+            translated_text=self.translated_text,
+            buffer_ms=self.buffer_ms,
+            extras={key: list(column) for key, column in self.extras.items()},
+            timestamp_lines=self.timestamp_lines,
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serializes the track to a compact binary artifact (an uncompressed npz archive of integer arrays), see `from_bytes`. Texts are stored as one utf-8 buffer plus offsets. `extras` are not stored"""
+        columns = {
+            "version": np.array([TRACK_ARTIFACT_VERSION], dtype=np.int64),
+            "numbers": self.numbers,
+            "start_ms": self.start_ms,
+            "end_ms": self.end_ms,
+            "break_until_next": self.break_until_next,
+            "buffer_ms": np.array([self.buffer_ms], dtype=np.int64),
+        }
+        columns["text"], columns["text_offsets"] = _pack_texts(self.text)
+        if self.translated_text is not None:
+            columns["translated_text"], columns["translated_text_offsets"] = _pack_texts(self.translated_text)
+        if self.timestamp_lines is not None:
+            # A cue without a line is stored as an empty string
+            columns["timestamp_lines"], columns["timestamp_lines_offsets"] = _pack_texts(
+                [line or "" for line in self.timestamp_lines]
+            )
+
+        out = io.BytesIO()
+        np.savez(out, **columns)
+        return out.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SubtitleTrack":
+        """Loads a track serialized with `to_bytes`
+
+        Raises
+        ------
+        ValueError
+            the artifact was written by an incompatible version
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as columns:
+            if int(columns["version"][0]) != TRACK_ARTIFACT_VERSION:
+                raise ValueError(f"Unsupported track artifact version: {int(columns['version'][0])}")
+            translated_text = None
+            if "translated_text" in columns.files:
+                translated_text = _unpack_texts(columns["translated_text"], columns["translated_text_offsets"])
+            timestamp_lines = None
+            if "timestamp_lines" in columns.files:
+                timestamp_lines = [
+                    line or None for line in _unpack_texts(columns["timestamp_lines"], columns["timestamp_lines_offsets"])
+                ]
+            return cls(
+                columns["numbers"],
+                columns["start_ms"],
+                columns["end_ms"],
+                _unpack_texts(columns["text"], columns["text_offsets"]),
+                break_until_next=columns["break_until_next"],
+                translated_text=translated_text,
+                buffer_ms=int(columns["buffer_ms"][0]),
+                timestamp_lines=timestamp_lines,
+            )
+
+    def cue_hashes(self) -> list:
+        """Returns a content hash of every cue, built from its text and (unbuffered) timing. Used to find the cues that changed between two versions of the same file"""
+        starts = (self.start_ms - self.buffer_ms).tolist()
+        ends = (self.end_ms + self.buffer_ms).tolist()
+        return [
+            hashlib.blake2b(f"{start}\x1f{end}\x1f{text}".encode("utf-8"), digest_size=8).hexdigest()
+            for start, end, text in zip(starts, ends, self.text)
+        ]
+
+    @property
+    def duration_ms(self) -> np.ndarray:
+        """Durations in milliseconds, with the buffer applied"""
+        return self.end_ms - self.start_ms
+
+    def srt_timestamps_line(self, i: int) -> str:
+        """Returns the srt formatted (unbuffered) timestamps of the cue at position `i`. The line is returned as it was read while it still matches the cue's times, so the output stays byte identical to the input, otherwise it is formatted from the times"""
+        line = self.timestamp_lines[i] if self.timestamp_lines is not None else None
+        if line is not None:
+            match = SRT_TIMESTAMP_LINE_REGEX.match(line)
+            if match is not None and match_to_ms(match) == (
+                int(self.start_ms[i]) - self.buffer_ms,
+                int(self.end_ms[i]) + self.buffer_ms,
+            ):
+                return line
+        return f"{ms_to_srt_time(self.start_ms[i] - self.buffer_ms)} --> {ms_to_srt_time(self.end_ms[i] + self.buffer_ms)}"
+
+    def interval_index(self) -> "IntervalIndex":
+        """Returns the interval index of the track, built on first use. Edits through the `Cue` views rebuild it, call `invalidate_index` after writing to the arrays directly"""
+        if self._index is None:
+            self._index = IntervalIndex(self.start_ms, self.end_ms)
+        return self._index
+
+    def invalidate_index(self) -> None:
+        self._index = None
+
+    def cue(self, i: int) -> Cue:
+        """Returns the cue at position `i`"""
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return Cue(self, i % len(self))
+
+    def _position(self, key) -> int:
+        if self._positions is None:
+            self._positions = {int(number): i for i, number in enumerate(self.numbers)}
+        return self._positions[int(key)]
+
+    def __getitem__(self, key) -> Cue:
+        try:
+            return Cue(self, self._position(key))
+        except (ValueError, TypeError):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(number) for number in self.numbers.tolist())
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __repr__(self) -> str:
+        return f"SubtitleTrack(cues={len(self)}, buffer_ms={self.buffer_ms}, translated={self.translated_text is not None})"
+
+
+class IntervalIndex:
+    """A sorted array index over the cues of a track, to find the neighbors of cues in time
+
+    Cues are sorted by start time. A running maximum of the end times tells whether an earlier starting cue is still active, which keeps the answers correct for overlapping or unordered cues.
+
+    Attributes
+    ----------
+    order: np.ndarray
+        track positions sorted by start time
+    rank: np.ndarray
+        the inverse of `order`, the sorted index of every track position
+    starts: np.ndarray
+        start times in sorted order
+    ends: np.ndarray
+        end times in sorted order
+    max_end: np.ndarray
+        running maximum of `ends`
+    """
+
+    __slots__ = ("order", "rank", "starts", "ends", "max_end")
+
+    def __init__(self, start_ms: np.ndarray, end_ms: np.ndarray):
+        self.order = np.argsort(start_ms, kind="stable")
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(self.order))
+        self.starts = start_ms[self.order]
+        self.ends = end_ms[self.order]
+        self.max_end = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def silence_after(self) -> np.ndarray:
+        """Returns the time from the end of every cue until the next cue starts, by track position. 0 for the last cue, for a cue that overlaps the next one and for a cue that ends while an earlier starting cue is still active"""
+        silence = np.zeros(len(self.order), dtype=np.int64)
+        if len(self.order) > 1:
+            # Every cue after sorted position r starts at or after starts[r + 1], and none before it is active after max_end[r]
+            silence[:-1] = self.starts[1:] - self.max_end[:-1]
+            silence[:-1][self.ends[:-1] < self.max_end[:-1]] = 0
+            np.maximum(silence, 0, out=silence)
+        return silence[self.rank]
+
+    def __len__(self) -> int:
+        return len(self.order)
@@ -0,0 +1,68 @@
+"""
+Run from api/src:
+
+    python -m unittest tests.test_deepl_api
+"""
+import random
+import unittest
+from types import SimpleNamespace
+
+import deepl
+
+from benchmarks.deepl_stub import MAX_REQUEST_BYTES, DeepLStub
+from deepl_api import DEEPL_API, DEEPL_MAX_REQUEST_BYTES, DEEPL_MAX_TEXTS_PER_REQUEST, pack_texts
+from timing import collect_timings
+
+
+def random_texts(alphabet: str, n_texts: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [
+        " ".join("".join(rng.choice(alphabet) for _ in range(rng.randint(2, 12))) for _ in range(rng.randint(20, 60)))
+        for _ in range(n_texts)
+    ]
+
+
+class PackTextsTest(unittest.TestCase):
+    """The packed requests are sent through the real deepl client to the stand-in, which measures the encoded bodies and answers 413 over the DeepL limit"""
+
+    def assert_requests_fit(self, texts: list) -> None:
+        packed = pack_texts(texts)
+        self.assertEqual(sorted(i for indices in packed for i in indices), list(range(len(texts))))
+
+        with DeepLStub() as stub:
+            translator = deepl.Translator("test", server_url=stub.url)
+            for indices in packed:
+                self.assertLessEqual(len(indices), DEEPL_MAX_TEXTS_PER_REQUEST)
+                translator.translate_text(
+                    [texts[i] for i in indices], target_lang="DE", formality="default", tag_handling="html"
+                )
+            self.assertEqual(stub.stats["requests"], len(packed))
+            self.assertLessEqual(stub.stats["max_request_bytes"], DEEPL_MAX_REQUEST_BYTES)
+            self.assertLessEqual(DEEPL_MAX_REQUEST_BYTES, MAX_REQUEST_BYTES)
+            # the budget is used, not met by sending tiny requests
+            self.assertGreater(stub.stats["max_request_bytes"], DEEPL_MAX_REQUEST_BYTES // 2)
+
+    def test_cyrillic_batch(self):
+        self.assert_requests_fit([text * 8 for text in random_texts("абвгдеёжзийклмнопрстуфхцчшщъыьэюя", 400)])
+
+    def test_english_batch_with_tags(self):
+        texts = [f"<span class='notranslate'>{text}</span> & more" * 8 for text in random_texts("abcdefghij", 400, seed=1)]
+        self.assert_requests_fit(texts)
+
+
+class TranslateManyTest(unittest.TestCase):
+    def test_request_spans_reach_the_caller(self):
+        texts = [f"text {i}" for i in range(DEEPL_MAX_TEXTS_PER_REQUEST * 3)]
+        # only translate_text of the client is used, so the requests need no DeepL account
+        client = SimpleNamespace(
+            translate_text=lambda text, **kwargs: [SimpleNamespace(text=t.upper()) for t in text]
+        )
+        with collect_timings() as timings:
+            translated = DEEPL_API.translate_many(client, texts, target_lang="DE", max_concurrent_requests=3)
+
+        self.assertEqual(translated, [text.upper() for text in texts])
+        self.assertEqual(timings.summary()["deepl_request"]["count"], len(pack_texts(texts)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sys import stdout
+from typing import Callable, Iterator, Optional
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=stdout,
+)
+
+
+class Timings:
+    """The spans recorded while handling one request
+
+    Attributes
+    ----------
+    spans: list
+        [{"name": str, "ms": float}] in the order the spans finished. Nested spans are named "parent/child"
+    """
+
+    def __init__(self):
+        self.spans: list = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            self.spans.append({"name": name, "ms": round(ms, 2)})
+
+    def summary(self) -> dict:
+        """Total milliseconds and number of calls per span name, {name: {"ms": float, "count": int}}"""
+        out: dict = {}
+        with self._lock:
+            for s in self.spans:
+                entry = out.setdefault(s["name"], {"ms": 0.0, "count": 0})
+                entry["ms"] = round(entry["ms"] + s["ms"], 2)
+                entry["count"] += 1
+        return out
+
+
+_timings: ContextVar[Optional[Timings]] = ContextVar("timings", default=None)
+_span_path: ContextVar[str] = ContextVar("span_path", default="")
+
+
+@contextmanager
+def collect_timings() -> Iterator[Timings]:
+    """Records every `span` entered in this context, i.e. for the duration of a request"""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times a block of code. The duration is logged, and recorded if a `collect_timings` context is active
+
+    Parameters
+    ----------
+    name: str
+        the stage name, nested spans are recorded as "parent/child"
+    """
+    parent = _span_path.get()
+    path = f"{parent}/{name}" if parent else name
+    token = _span_path.set(path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        _span_path.reset(token)
+        logging.debug(f"SPAN {path}: {ms:0.1f} ms")
+        timings = _timings.get()
+        if timings != None:
+            timings.add(path, ms)
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator version of `span`, the span is named after the function by default"""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,77 @@
+from collections.abc import Mapping
+from typing import NamedTuple, Union
+
+import numpy as np
+
+from subtitles import SubtitleTrack
+
+# Range of the speed factors sent to Azure, the prosody rate is limited to -50% ... +100%
+MIN_SPEED_FACTOR = 0.5
+MAX_SPEED_FACTOR = 2.0
+
+
+class TimingPlan(NamedTuple):
+    """The planned timing of every cue of a track, in track order
+
+    Attributes
+    ----------
+    speed_factor: np.ndarray
+        the rate to synthesize each clip at, relative to the default rate
+    target_ms: np.ndarray
+        the length each clip is planned to have, its duration plus the silence it borrows
+    overflow_ms: np.ndarray
+        the silence after each cue a clip may use, at most the planner's `max_overflow_ms`
+    """
+
+    speed_factor: np.ndarray
+    target_ms: np.ndarray
+    overflow_ms: np.ndarray
+
+
+def available_overflow_ms(subs_dict: Union[SubtitleTrack, Mapping], max_overflow_ms: int) -> np.ndarray:
+    """
+    Returns how far the clip of every cue may run into the silence after it, capped at `max_overflow_ms`
+
+    The silence is found with the track's interval index, up to the start of the next cue in time, so overlapping or unordered cues never borrow time another clip is playing in. Combined cues keep the `break_until_next` of their first cue, so it is not used. The buffers around the cues are not borrowed, so the clips stay at least twice the buffer apart
+    """
+    track = subs_dict if isinstance(subs_dict, SubtitleTrack) else SubtitleTrack.from_dict(subs_dict)
+    overflow = np.zeros(len(track), dtype=np.int64)
+    if len(track) and max_overflow_ms > 0:
+        overflow = track.interval_index().silence_after() - 2 * track.buffer_ms
+        np.clip(overflow, 0, max_overflow_ms, out=overflow)
+    return overflow
+
+
+def plan_timing(
+    subs_dict: Union[SubtitleTrack, Mapping],
+    predicted_ms,
+    max_overflow_ms: int = 0,
+) -> TimingPlan:
+    """
+    Plans the speed factors of a whole track at once. A clip predicted to be longer than its cue may run into the silence after the cue, up to `max_overflow_ms`, before it is sped up. A shorter clip is slowed down to fill its cue, like without the planner.
+
+    Parameters
+    ----------
+    subs_dict: SubtitleTrack | Mapping
+        the cues, in order
+    predicted_ms: array like
+        the predicted length of every clip at the default rate
+    max_overflow_ms: int
+        the most silence a clip may borrow from the break until the next cue, 0 to make every clip fit its own cue
+
+    Returns
+    -------
+    TimingPlan
+    """
+    track = subs_dict if isinstance(subs_dict, SubtitleTrack) else SubtitleTrack.from_dict(subs_dict)
+    predicted = np.asarray(predicted_ms, dtype=np.float64)
+    duration = track.duration_ms.astype(np.float64)
+    overflow = available_overflow_ms(track, max_overflow_ms)
+
+    # Only borrow what the clip needs past the end of its cue
+    target = np.where(predicted > duration, np.minimum(predicted, duration + overflow), duration)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speedFactor = np.where((target > 0) & (predicted > 0), predicted / target, 1.0)
+    speedFactor = np.clip(np.nan_to_num(speedFactor, nan=1.0), MIN_SPEED_FACTOR, MAX_SPEED_FACTOR)
+
+    return TimingPlan(speedFactor, target, overflow)
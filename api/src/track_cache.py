@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import tempfile
+from sys import stdout
+
+from subtitles import TRACK_ARTIFACT_VERSION, SubtitleTrack
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=stdout,
+)
+
+# Local directory for parsed track artifacts, shared by all requests served by this instance
+TRACK_CACHE_DIR = os.environ.get(
+    "TRACK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "auto-dub-tracks")
+)
+# Maximum total size of the local cache, the least recently used artifacts are removed past it
+TRACK_CACHE_MAX_BYTES = int(os.environ.get("TRACK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def track_cache_key(md5_hash: str, generation, add_line_buffer_milliseconds) -> str:
+    """Builds the cache key of a parsed srt file from the storage metadata of the source blob, the parse settings and the artifact format version
+
+    Parameters
+    ----------
+    md5_hash: str
+        the base64 md5 of the source blob, as reported by storage
+    generation: int
+        the generation of the source blob
+    add_line_buffer_milliseconds: int
+        the buffer the track was parsed with
+    """
+    raw = f"{md5_hash}:{generation}:{add_line_buffer_milliseconds or 0}:{TRACK_ARTIFACT_VERSION}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def track_artifact_path(main_srt: str, add_line_buffer_milliseconds) -> str:
+    """The storage path of the parsed artifact of an srt file, stored next to it"""
+    return f"{main_srt}.{add_line_buffer_milliseconds or 0}.track"
+
+
+def load_cached_track(key: str) -> SubtitleTrack | None:
+    """Loads a parsed track from the local cache, None if it is not cached or unreadable"""
+    path = os.path.join(TRACK_CACHE_DIR, f"{key}.track")
+    try:
+        with open(path, "rb") as f:
+            track = SubtitleTrack.from_bytes(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.debug(f"DISCARDING LOCAL TRACK ARTIFACT {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # the mtime marks the artifact as recently used for the eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return track
+
+
+def save_cached_track(key: str, data: bytes) -> None:
+    """Stores a serialized track in the local cache, then evicts the least recently used artifacts over TRACK_CACHE_MAX_BYTES. The file is written under a temporary name and then renamed, so concurrent readers never see a partial artifact. The cache is optional, errors are logged and never raised"""
+    try:
+        os.makedirs(TRACK_CACHE_DIR, exist_ok=True)
+        path = os.path.join(TRACK_CACHE_DIR, f"{key}.track")
+        fd, tmp_path = tempfile.mkstemp(dir=TRACK_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        evict_cached_tracks()
+    except Exception as e:
+        logging.debug(f"COULD NOT CACHE TRACK ARTIFACT {key}: {e}")
+
+
+def evict_cached_tracks(max_bytes: int = TRACK_CACHE_MAX_BYTES) -> None:
+    """Removes the least recently used artifacts until the local cache holds at most `max_bytes`"""
+    entries = []
+    with os.scandir(TRACK_CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".track"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    logging.debug(f"TRACK CACHE EVICTED: {evicted}")
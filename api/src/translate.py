@@ -1,12 +1,20 @@
 import logging
-import os
 from sys import stdout
+from typing import Optional
 
 from deepl_api import DEEPL_API
-from translate_utils import (add_notranslate_tags_for_manual_translations,
-                             add_notranslate_tags_from_notranslate_file,
-                             combine_single_pass, process_response_text)
-from utils import csv_to_dict, txt_to_list
+from ssml_config import SSML_CONFIG
+from subtitle_combine import combine_subtitles_heap
+from subtitles import SubtitleTrack
+from timing import span, timed
+from translate_utils import (add_notranslate_placeholders,
+                             add_notranslate_tags,
+                             notranslate_regex_for_language,
+                             response_processor_for_language)
+from translation_memory import get_translation_memory, translation_key
+
+# The SSML_Customization files that change what is sent to DeepL, translations are cached per version of them
+GLOSSARY_FILES = ("dont_translate_phrases", "url_list", "manual_translations")
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -16,47 +24,135 @@ logging.basicConfig(
 )
 
 
-def combine_subtitles_advanced(inputDict, maxCharacters=200):
+def combine_subtitles_advanced(inputDict, maxCharacters=200) -> SubtitleTrack:
     """Combines subtitle lines that are close together and have a similar speaking rate. Useful when sentences are split into multiple subtitle lines. Voice synthesis will have fewer unnatural pauses.
 
-    TODO: REWRITE THIS FUNCTION AT SOME POINT, split into multiple functions with more options
+    Makes the same merges as the legacy `combine_single_pass` loop in O(n log n), see `subtitle_combine.combine_subtitles_heap`
     """
     charRateGoal = 20  # 20
     gapThreshold = 100  # The maximum gap between subtitles to combine
-    noMorePossibleCombines = False
-    # Convert dictionary to list of dictionaries of the values
-    entryList = []
 
     logging.debug(
-        f"CONVERTING DICT TO LIST - charRateGoal: {charRateGoal}, gapThreshold: {gapThreshold}, maxCharacters: {maxCharacters}"
+        f"COMBINING SUBTITLES - charRateGoal: {charRateGoal}, gapThreshold: {gapThreshold}, maxCharacters: {maxCharacters}"
     )
+    return combine_subtitles_heap(inputDict, charRateGoal, gapThreshold, maxCharacters)
 
-    for key, value in inputDict.items():
-        value["originalIndex"] = int(key) - 1
-        entryList.append(value)
 
-    while not noMorePossibleCombines:
-        entryList, noMorePossibleCombines = combine_single_pass(
-            entryList, charRateGoal, gapThreshold, maxCharacters
+@timed()
+def deepl_translate(textToTranslate: list, target_language: str, formality: str) -> list:
+    """Sends texts to DeepL, packed into as few requests as its limits allow and sent in parallel, see `DEEPL_API.translate_many`
+
+    Returns
+    -------
+    list
+        the raw translated texts, in the order of `textToTranslate`
+    """
+    if not textToTranslate:
+        return []
+    return DEEPL_API().translate_many(
+        textToTranslate,
+        target_lang=target_language,
+        formality=formality,
+        tag_handling="html",
+    )
+
+
+def translate_texts(textToTranslate: list, target_language: str, formality: str) -> list:
+    """Translates tagged texts. Repeated texts, i.e. "[Music]", are only translated once, see `translate_unique_texts`
+
+    Parameters
+    ----------
+    textToTranslate: list
+        the texts, with notranslate tags added
+    target_language: str
+        the target language
+    formality: str
+        the formality of the translation
+
+    Returns
+    -------
+    list
+        the raw DeepL translations, in the order of `textToTranslate`
+    """
+    uniqueTexts = list(dict.fromkeys(textToTranslate))
+    logging.debug(f"UNIQUE TEXTS TO TRANSLATE: {len(uniqueTexts)} of {len(textToTranslate)}")
+    translations = dict(
+        zip(uniqueTexts, translate_unique_texts(uniqueTexts, target_language, formality))
+    )
+    return [translations[text] for text in textToTranslate]
+
+
+def glossary_version() -> str:
+    """A hash of the current contents of the SSML_Customization files that change translations, see GLOSSARY_FILES"""
+    return ".".join(SSML_CONFIG.versions(GLOSSARY_FILES))
+
+
+def translate_unique_texts(textToTranslate: list, target_language: str, formality: str) -> list:
+    """Translates tagged texts, answering from the translation memory where possible and only sending the misses to DeepL
+
+    Parameters
+    ----------
+    textToTranslate: list
+        the texts, with notranslate tags added
+    target_language: str
+        the target language
+    formality: str
+        the formality of the translation
+
+    Returns
+    -------
+    list
+        the raw DeepL translations, in the order of `textToTranslate`
+    """
+    memory = get_translation_memory()
+    if memory == None:
+        return deepl_translate(textToTranslate, target_language, formality)
+
+    glossaryVersion = glossary_version()
+    keys = [
+        translation_key(text, target_language, formality, glossaryVersion)
+        for text in textToTranslate
+    ]
+    try:
+        with span("translation_memory_lookup"):
+            hits = memory.get_many(keys)
+    except Exception as e:
+        logging.debug(f"TRANSLATION MEMORY LOOKUP FAILED: {e}")
+        hits = {}
+
+    misses = [i for i, key in enumerate(keys) if key not in hits]
+    logging.debug(f"TRANSLATION MEMORY HITS: {len(keys) - len(misses)} of {len(keys)}")
+
+    missTranslations = deepl_translate([textToTranslate[i] for i in misses], target_language, formality)
+    newEntries = {keys[i]: text for i, text in zip(misses, missTranslations)}
+    try:
+        memory.put_many(
+            newEntries,
+            source_sizes={keys[i]: len(textToTranslate[i].encode("utf-8")) for i in misses},
         )
+    except Exception as e:
+        logging.debug(f"TRANSLATION MEMORY STORE FAILED: {e}")
 
-    # Convert the list back to a dictionary then return it
-    return dict(enumerate(entryList, start=1))
+    # Merge the hits back in text order
+    hits.update(newEntries)
+    return [hits[key] for key in keys]
 
 
 def translate(
-    subs_dict: dict,
+    subs_dict: SubtitleTrack,
     target_language: str,
     formality: str = "default",
     combine_subtitles: bool = True,
     combine_max_characters: int = 200,
-):
-    """Translates a subtitle dictionary into the target language.
+    cue_translations: Optional[dict] = None,
+    protect_with_placeholders: bool = False,
+) -> SubtitleTrack:
+    """Translates a subtitle track into the target language.
 
     Parameters
     ----------
-    subs_dict: dict
-        A dictionary containing subtitle information.
+    subs_dict: SubtitleTrack
+        The subtitle track to translate. It is not modified, a plain subtitles dictionary is accepted as well.
     target_language: str
         The target language to translate to.
     formality: str default="default"
@@ -65,111 +161,73 @@ def translate(
         Whether to combine subtitles that are close together and have a similar speaking rate. Useful when sentences are split into multiple subtitle lines. Voice synthesis will have fewer unnatural pauses.
     combine_max_characters: int default=200
         The maximum number of characters to combine subtitles into if combine_subtitles is true.
+    cue_translations: dict default=None
+        {cue hash: translated text} from an earlier translation of the same file into the same language, see `SubtitleTrack.cue_hashes`. Cues found in it are not sent to DeepL again. It is updated in place to hold the (uncombined) translation of every cue of this track.
+    protect_with_placeholders: bool default=False
+        Whether to send phrases that should not be translated as short placeholders instead of wrapping them in notranslate tags. Fewer characters are sent and billed.
 
     Returns
     -------
-    dict
-        A dictionary containing the translated subtitle information.
+    SubtitleTrack
+        A new track with `translated_text` set.
 
     """
     logging.debug(
         f"TRANSLATING - target_language: {target_language}, formality: {formality}, combine_subtitles: {combine_subtitles}, combine_max_characters: {combine_max_characters}"
     )
 
-    noTranslateOverrideFile = os.path.abspath(
-        "SSML_Customization/dont_translate_phrases.txt"
-    )
-    manualTranslationOverrideFile = os.path.abspath(
-        "SSML_Customization/Manual_Translations.csv"
-    )
-    urlListFile = os.path.abspath("SSML_Customization/url_list.txt")
-
-    # put them into dictionaries
-    dontTranslateList = txt_to_list(noTranslateOverrideFile)
-    manualTranslationsDict = csv_to_dict(manualTranslationOverrideFile)
-    urlList = txt_to_list(urlListFile)
     textToTranslate = []
 
-    deepl_api = DEEPL_API()
-
-    for key in subs_dict:
-        originalText = subs_dict[key]["text"]
-        # Add any 'notranslate' tags to the text
-        processedText = add_notranslate_tags_from_notranslate_file(
-            originalText, dontTranslateList
-        )
-        processedText = add_notranslate_tags_from_notranslate_file(
-            processedText, urlList
-        )
-        processedText = add_notranslate_tags_for_manual_translations(
-            processedText, target_language
-        )
-
-        # Add the text to the list of text to be translated
+    # Work on a copy, the same source track is translated into every language of the order
+    subs_dict = SubtitleTrack.from_dict(subs_dict)
+
+    # Only cues that changed since the previous translation are sent to DeepL
+    if cue_translations is None:
+        cue_translations = {}
+    cueHashes = subs_dict.cue_hashes()
+    missing = [i for i, h in enumerate(cueHashes) if h not in cue_translations]
+    logging.debug(f"CUES TO TRANSLATE: {len(missing)} of {len(cueHashes)}")
+
+    # All phrase lists are compiled into one regex, so each cue is scanned once however long the lists are
+    notranslateRegex = notranslate_regex_for_language(target_language)
+
+    protectedPhrases = []
+    for i in missing:
+        # Add any 'notranslate' tags or placeholders to the text, then add it to the list of text to be translated
+        if protect_with_placeholders:
+            processedText, protected = add_notranslate_placeholders(subs_dict.text[i], notranslateRegex)
+            protectedPhrases.append(protected)
+        else:
+            processedText = add_notranslate_tags(subs_dict.text[i], notranslateRegex)
+            protectedPhrases.append(None)
         textToTranslate.append(processedText)
 
     logging.debug("TAGS SET")
 
-    codepoints = 0
-    for text in textToTranslate:
-        codepoints += len(text.encode("utf-8"))
-
-    if codepoints > 120000:
-        chunkSize = 400
-        chunkedTexts = [
-            textToTranslate[x : x + chunkSize]
-            for x in range(0, len(textToTranslate), chunkSize)
-        ]
-
-        # Send and receive the batch requests
-        for j, chunk in enumerate(chunkedTexts):
-
-            logging.debug(
-                f"[DeepL] Translating text group {j+1} of {len(chunkedTexts)}"
-            )
-
-            # Send the request
-            result = deepl_api.translate_text(
-                chunk,
-                target_lang=target_language,
-                formality=formality,
-                tag_handling="html",
-            )
-
-            # Extract the translated texts from the response
-            translatedTexts = [process_response_text(result[i].text, target_language) for i in range(len(result))]  # type: ignore
-
-            # Add the translated texts to the dictionary
-            for i in range(chunkSize):
-                key = str((i + 1 + j * chunkSize))
-                subs_dict[key]["translated_text"] = process_response_text(
-                    translatedTexts[i], target_language
-                )
-                # Print progress, ovwerwrite the same line
-                logging.debug(f" Translated with DeepL: {key} of {len(subs_dict)}")
-    else:
-
-        logging.debug("Sending request to DeepL")
-
-        result = deepl_api.translate_text(
-            text=textToTranslate,
-            target_lang=target_language,
-            formality=formality,
-            tag_handling="html",
-        )
+    rawTranslations = translate_texts(textToTranslate, target_language, formality)
+    # Unescape, remove the tags, restore the placeholders and apply the manual translations, in one scan of a regex compiled once per language
+    processResponse = response_processor_for_language(target_language)
+    translatedTexts = [
+        processResponse(text, protected)
+        for text, protected in zip(rawTranslations, protectedPhrases)
+    ]
 
-        logging.debug("Received response from DeepL")
+    # Merge the new translations with the reused ones, then add them to the track
+    for i, translatedText in zip(missing, translatedTexts):
+        cue_translations[cueHashes[i]] = translatedText
+    subs_dict.translated_text = [cue_translations[h] for h in cueHashes]
 
-        # Add the translated texts to the dictionary
-        for i, key in enumerate(subs_dict):
-            subs_dict[key]["translated_text"] = process_response_text(result[i].text, target_language)  # type: ignore
+    # Only keep the cues of this track
+    currentTranslations = dict(zip(cueHashes, subs_dict.translated_text))
+    cue_translations.clear()
+    cue_translations.update(currentTranslations)
 
-        logging.debug("Added translated texts to dictionary")
+    logging.debug("Added translated texts to track")
 
     # Combine subtitles if requested
     if combine_subtitles:
         subs_dict = combine_subtitles_advanced(subs_dict, combine_max_characters)
 
-    logging.debug("Returning dictionary")
+    logging.debug("Returning track")
 
     return subs_dict
@@ -1,25 +1,13 @@
-import copy
+import functools
 import html
-import os
+import logging
 import re
 from operator import itemgetter
 from typing import Any
 
-from utils import csv_to_dict, txt_to_list
-
-# Import files from SSML_Customization folder
-noTranslateOverrideFile = os.path.abspath(
-    "SSML_Customization/dont_translate_phrases.txt"
-)
-manualTranslationOverrideFile = os.path.abspath(
-    "SSML_Customization/Manual_Translations.csv"
-)
-urlListFile = os.path.abspath("SSML_Customization/url_list.txt")
-
-# put them into dictionaries
-dontTranslateList = txt_to_list(noTranslateOverrideFile)
-manualTranslationsDict = csv_to_dict(manualTranslationOverrideFile)
-urlList = txt_to_list(urlListFile)
+from ssml_config import SSML_CONFIG
+from subtitle_combine import combine_subtitles_heap, speaking_rates
+from subtitles import SubtitleTrack
 
 # ================================================================================================
 #                           Helper Functions for translating text
@@ -34,109 +22,155 @@ def create_sub_dict(srtFile, addBufferMilliseconds: int = 0):
         addBufferMilliseconds (int, optional): The number of milliseconds to add to the start and end times of the subtitles. Defaults to 0.
 
     Returns:
-        dict: A dictionary of subtitles
+        SubtitleTrack: A dict compatible track of subtitles
 
     """
     with open(srtFile, "r", encoding="utf-8-sig") as f:
-        lines = f.readlines()
+        return SubtitleTrack.from_srt(f, addBufferMilliseconds)
+
+
+def _phrase_trie_pattern(phrases) -> str:
+    """
+    Builds a regex alternation of the literal phrases, factored as a trie so a scan only tries the phrases that share the characters read so far. Where one phrase is a prefix of another, the longer one is tried first.
+
+    Parameters
+    ----------
+    phrases: Iterable[str]
+        the phrases, they are matched literally
+    """
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end of a phrase
+
+    def to_pattern(node) -> str:
+        isEnd = "" in node
+        branches = [re.escape(char) + to_pattern(child) for char, child in node.items() if char != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not isEnd:
+            return branches[0]
+        body = "(?:" + "|".join(branches) + ")"
+        return body + "?" if isEnd else body
+
+    return to_pattern(trie)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_notranslate_regex(phrases: tuple) -> re.Pattern | None:
+    """
+    Compiles a phrase list into a single case insensitive regex that finds every phrase in one scan of a text, see `add_notranslate_tags`. Compiled regexes are cached by phrase list.
+
+    Parameters
+    ----------
+    phrases: tuple
+        the phrases to not translate, matched literally
 
-    # Matches the following example with regex:    00:00:20,130 --> 00:00:23,419
-    subtitleTimeLineRegex = re.compile(
-        r"\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d"
+    Returns
+    -------
+    re.Pattern | None
+        None if there are no phrases
+    """
+    phrases = tuple(phrase for phrase in phrases if phrase)
+    if not phrases:
+        return None
+    # Find a phrase, with optional punctuation after, and optional quotes before or after
+    return re.compile(
+        rf'(\b["\'()]?(?:{_phrase_trie_pattern(phrases)})[.,!?()]?["\']?\b)',
+        flags=re.IGNORECASE,
     )
 
-    # Create a dictionary
-    subsDict = {}
-
-    # Enumerate lines, and if a line in lines contains only an integer, put that number in the key, and a dictionary in the value
-    # The dictionary contains the start, ending, and duration of the subtitles as well as the text
-    # The next line uses the syntax HH:MM:SS,MMM --> HH:MM:SS,MMM . Get the difference between the two times and put that in the dictionary
-    # For the line after that, put the text in the dictionary
-    for lineNum, line in enumerate(lines):
-        line = line.strip()
-        if line.isdigit() and subtitleTimeLineRegex.match(lines[lineNum + 1]):
-            lineWithTimestamps = lines[lineNum + 1].strip()
-            lineWithSubtitleText = lines[lineNum + 2].strip()
-
-            # If there are more lines after the subtitle text, add them to the text
-            count = 3
-            while True:
-                # Check if the next line is blank or not
-                if (lineNum + count) < len(lines) and lines[lineNum + count].strip():
-                    lineWithSubtitleText += " " + lines[lineNum + count].strip()
-                    count += 1
-                else:
-                    break
 
-            # Create empty dictionary with keys for start and end times and subtitle text
-            subsDict[line] = {
-                "start_ms": "",
-                "end_ms": "",
-                "duration_ms": "",
-                "text": "",
-                "break_until_next": "",
-                "srt_timestamps_line": lineWithTimestamps,
-            }
-
-            time = lineWithTimestamps.split(" --> ")
-            time1 = time[0].split(":")
-            time2 = time[1].split(":")
-
-            # Converts the time to milliseconds
-            processedTime1 = (
-                int(time1[0]) * 3600000
-                + int(time1[1]) * 60000
-                + int(time1[2].split(",")[0]) * 1000
-                + int(time1[2].split(",")[1])
-            )  # / 1000 #Uncomment to turn into seconds
-            processedTime2 = (
-                int(time2[0]) * 3600000
-                + int(time2[1]) * 60000
-                + int(time2[2].split(",")[0]) * 1000
-                + int(time2[2].split(",")[1])
-            )  # / 1000 #Uncomment to turn into seconds
-            timeDifferenceMs = str(processedTime2 - processedTime1)
-
-            # Adjust times with buffer
-            if addBufferMilliseconds > 0:
-                subsDict[line]["start_ms_buffered"] = str(
-                    processedTime1 + addBufferMilliseconds
-                )
-                subsDict[line]["end_ms_buffered"] = str(
-                    processedTime2 - addBufferMilliseconds
-                )
-                subsDict[line]["duration_ms_buffered"] = str(
-                    (processedTime2 - addBufferMilliseconds)
-                    - (processedTime1 + addBufferMilliseconds)
-                )
-            else:
-                subsDict[line]["start_ms_buffered"] = str(processedTime1)
-                subsDict[line]["end_ms_buffered"] = str(processedTime2)
-                subsDict[line]["duration_ms_buffered"] = str(
-                    processedTime2 - processedTime1
-                )
+def manual_translation_phrases(langcode, manualTranslations=None) -> list:
+    """
+    Returns the original texts of the manual translations for a language
 
-            # Set the keys in the dictionary to the values
-            subsDict[line]["start_ms"] = str(processedTime1)
-            subsDict[line]["end_ms"] = str(processedTime2)
-            subsDict[line]["duration_ms"] = timeDifferenceMs
-            subsDict[line]["text"] = lineWithSubtitleText
-            if lineNum > 0:
-                # Goes back to previous line's dictionary and writes difference in time to current line
-                subsDict[str(int(line) - 1)]["break_until_next"] = processedTime1 - int(
-                    subsDict[str(int(line) - 1)]["end_ms"]
-                )
-            else:
-                subsDict[line]["break_until_next"] = 0
+    Parameters
+    ----------
+    langcode: str
+        The language code of the translation
+    manualTranslations: list
+        The rows of the manual translations file, defaults to the current SSML_Customization file
+    """
+    if manualTranslations is None:
+        manualTranslations = SSML_CONFIG.get("manual_translations")
+    return [
+        row["Original Text"]
+        for row in manualTranslations
+        if row["Language Code"] == langcode
+    ]
+
+
+def notranslate_regex_for_language(langcode) -> re.Pattern | None:
+    """
+    Returns the compiled regex of every phrase that should not be translated into a language: the dont translate phrases, the urls and the manual translations. It is only rebuilt when one of the SSML_Customization files changes
+
+    Parameters
+    ----------
+    langcode: str
+        The target language code
+    """
+    return SSML_CONFIG.derived(
+        ("notranslate_regex", langcode),
+        ("dont_translate_phrases", "url_list", "manual_translations"),
+        lambda: compile_notranslate_regex(
+            tuple(
+                SSML_CONFIG.get("dont_translate_phrases")
+                + SSML_CONFIG.get("url_list")
+                + manual_translation_phrases(langcode)
+            )
+        ),
+    )
+
+
+def add_notranslate_tags(text, notranslateRegex) -> str:
+    """
+    This function adds <span class="notranslate"> around every phrase found by a regex from `compile_notranslate_regex`
+
+    Parameters
+    ----------
+    text: str
+        The text to add <span class="notranslate"> tags to
+    notranslateRegex: re.Pattern | None
+        The compiled phrase list, None to leave the text unchanged
+
+    Returns
+    -------
+    str
+        The text with <span class="notranslate"> around the phrases
+    """
+    if notranslateRegex is None:
+        return text
+    return notranslateRegex.sub(r'<span class="notranslate">\1</span>', text)
 
-    # Apply the buffer to the start and end times by setting copying over the buffer values to main values
-    for key, value in subsDict.items():
-        if addBufferMilliseconds > 0:
-            subsDict[key]["start_ms"] = value["start_ms_buffered"]
-            subsDict[key]["end_ms"] = value["end_ms_buffered"]
-            subsDict[key]["duration_ms"] = value["duration_ms_buffered"]
 
-    return subsDict
+def add_notranslate_placeholders(text, notranslateRegex) -> tuple[str, list]:
+    """
+    This function replaces every phrase found by a regex from `compile_notranslate_regex` with a short placeholder tag, `<x id="N"/>`, where N counts from 0 in each text. DeepL leaves the tags alone, so only the placeholder is sent and billed instead of the phrase wrapped in a notranslate span. The phrases are put back by `ResponseProcessor`
+
+    Parameters
+    ----------
+    text: str
+        The text to add placeholders to
+    notranslateRegex: re.Pattern | None
+        The compiled phrase list, None to leave the text unchanged
+
+    Returns
+    -------
+    tuple[str, list]
+        The text with placeholders, and the protected phrases in placeholder id order
+    """
+    protected: list = []
+    if notranslateRegex is None:
+        return text, protected
+
+    def to_placeholder(match):
+        protected.append(match.group(1))
+        return f'<x id="{len(protected) - 1}"/>'
+
+    return notranslateRegex.sub(to_placeholder, text), protected
 
 
 def add_notranslate_tags_from_notranslate_file(text, phraseList) -> Any | str:
@@ -155,15 +189,7 @@ def add_notranslate_tags_from_notranslate_file(text, phraseList) -> Any | str:
         The text with <span class="notranslate"> around words in the phraseList
 
     """
-    for word in phraseList:
-        findWordRegex = rf'(\b["\'()]?{word}[.,!?()]?["\']?\b)'  # Find the word, with optional punctuation after, and optional quotes before or after
-        text = re.sub(
-            findWordRegex,
-            r'<span class="notranslate">\1</span>',
-            text,
-            flags=re.IGNORECASE,
-        )
-    return text
+    return add_notranslate_tags(text, compile_notranslate_regex(tuple(phraseList)))
 
 
 def remove_notranslate_tags(text) -> Any | str:
@@ -203,18 +229,9 @@ def add_notranslate_tags_for_manual_translations(text, langcode) -> Any | str:
         The text with <span class="notranslate"> around words in the manualTranslationsDict
 
     """
-    for manualTranslatedText in manualTranslationsDict:
-        # Only replace text if the language matches the entry in the manual translations file
-        if manualTranslatedText["Language Code"] == langcode:
-            originalText = manualTranslatedText["Original Text"]
-            findWordRegex = rf'(\b["\'()]?{originalText}[.,!?()]?["\']?\b)'
-            text = re.sub(
-                findWordRegex,
-                r'<span class="notranslate">\1</span>',
-                text,
-                flags=re.IGNORECASE,
-            )
-    return text
+    return add_notranslate_tags(
+        text, compile_notranslate_regex(tuple(manual_translation_phrases(langcode)))
+    )
 
 
 def replace_manual_translations(text, langcode) -> Any:
@@ -234,7 +251,7 @@ def replace_manual_translations(text, langcode) -> Any:
         The text with words in the manualTranslationsDict replaced with their translations
 
     """
-    for manualTranslatedText in manualTranslationsDict:
+    for manualTranslatedText in SSML_CONFIG.get("manual_translations"):
         # Only replace text if the language matches the entry in the manual translations file
         if manualTranslatedText["Language Code"] == langcode:
             originalText = manualTranslatedText["Original Text"]
@@ -244,50 +261,66 @@ def replace_manual_translations(text, langcode) -> Any:
     return text
 
 
-def combine_subtitles_advanced(inputDict, maxCharacters=200):
+def combine_subtitles_advanced(inputDict, maxCharacters=200) -> SubtitleTrack:
     """Combines subtitle lines that are close together and have a similar speaking rate. Useful when sentences are split into multiple subtitle lines. Voice synthesis will have fewer unnatural pauses.
 
-    TODO: REWRITE THIS FUNCTION AT SOME POINT, split into multiple functions with more options
+    Makes the same merges as `combine_subtitles_legacy`, see `subtitle_combine.combine_subtitles_heap`
     """
     charRateGoal = 20  # 20
     gapThreshold = 100  # The maximum gap between subtitles to combine
+
+    logging.debug(
+        f"COMBINING SUBTITLES - charRateGoal: {charRateGoal}, gapThreshold: {gapThreshold}, maxCharacters: {maxCharacters}"
+    )
+    return combine_subtitles_heap(inputDict, charRateGoal, gapThreshold, maxCharacters)
+
+
+def combine_subtitles_legacy(inputDict, maxCharacters=200, charRateGoal=20, gapThreshold=100) -> SubtitleTrack:
+    """The original `combine_single_pass` loop, kept to check and benchmark `combine_subtitles_advanced` against. It is O(n^2) or worse, don't use it for orders"""
     noMorePossibleCombines = False
     # Convert dictionary to list of dictionaries of the values
     entryList = []
 
     for key, value in inputDict.items():
+        # Work on plain dict copies, so the merges don't write through to the input track
+        value = dict(value)
         value["originalIndex"] = int(key) - 1
         entryList.append(value)
 
-    while not noMorePossibleCombines:
+    while entryList and not noMorePossibleCombines:
         entryList, noMorePossibleCombines = combine_single_pass(
             entryList, charRateGoal, gapThreshold, maxCharacters
         )
 
-    # Convert the list back to a dictionary then return it
-    return dict(enumerate(entryList, start=1))
+    # Convert the list back to a track then return it
+    return SubtitleTrack.from_dict(dict(enumerate(entryList, start=1)))
 
 
 def calc_dict_speaking_rates(inputDict, dictKey="translated_text"):
-    tempDict = copy.deepcopy(inputDict)
-    for key, value in tempDict.items():
-        tempDict[key]["char_rate"] = round(
-            len(value[dictKey]) / (int(value["duration_ms"]) / 1000), 2
-        )
+    """Returns a copy of the subtitles dictionary with the char_rate of every cue, computed in one vectorized step. Only the cue dicts are copied, not the texts. See `subtitle_combine.speaking_rates`"""
+    tempDict = {key: dict(value) for key, value in inputDict.items()}
+    values = list(tempDict.values())
+    rates, _ = speaking_rates(
+        [len(value[dictKey]) for value in values],
+        [int(value["duration_ms"]) for value in values],
+    )
+    for value, rate in zip(values, rates.tolist()):
+        value["char_rate"] = rate
     return tempDict
 
 
 def calc_list_speaking_rates(inputList, charRateGoal, dictKey="translated_text"):
-    tempList = copy.deepcopy(inputList)
-    for i in range(len(tempList)):
-        # Calculate the number of characters per second based on the duration of the entry
-        tempList[i]["char_rate"] = round(
-            len(tempList[i][dictKey]) / (int(tempList[i]["duration_ms"]) / 1000), 2
-        )
-        # Calculate the difference between the current char_rate and the goal char_rate - Absolute Value
-        tempList[i]["char_rate_diff"] = abs(
-            round(tempList[i]["char_rate"] - charRateGoal, 2)
-        )
+    """Returns a copy of the list of cues with the char_rate and char_rate_diff of every cue, computed in one vectorized step. Only the cue dicts are copied, not the texts. See `subtitle_combine.speaking_rates`"""
+    tempList = [dict(entry) for entry in inputList]
+    rates, diffs = speaking_rates(
+        [len(entry[dictKey]) for entry in tempList],
+        [int(entry["duration_ms"]) for entry in tempList],
+        charRateGoal,
+    )
+    for entry, rate, diff in zip(tempList, rates.tolist(), diffs.tolist()):
+        # Characters per second, and the absolute difference to the goal char_rate
+        entry["char_rate"] = rate
+        entry["char_rate_diff"] = diff
     return tempList
 
 
@@ -524,9 +557,84 @@ def combine_single_pass(entryListLocal, charRateGoal, gapThreshold, maxCharacter
     return entryListLocal, noMorePossibleCombines
 
 
-def process_response_text(text, targetLanguage) -> Any:
+class ResponseProcessor:
+    """
+    Post-processes DeepL responses for one target language. html entities are unescaped first, so manual translations also match phrases DeepL escaped. Then one scan of a single compiled regex removes the notranslate tags, restores the placeholders and substitutes the manual translations. A restored phrase is matched against the manual translations on its own, like the original chain matched it after restoring. Build it with `response_processor_for_language`, it is compiled once per version of the manual translations file.
+
+    Parameters
+    ----------
+    manualTranslations: list
+        (original text, translated text) pairs of the language, in file order
+    """
+
+    MARKUP_PATTERN = r'(?P<tag><span class="notranslate">|</span>)|(?P<placeholder><x\s+id="(?P<id>\d+)"\s*/?>(?:</x>)?)'
+
+    def __init__(self, manualTranslations: list):
+        # lower cased phrase -> translation, the first row wins like the sequential substitutions did
+        self.replacements: dict = {}
+        for originalText, translatedText in manualTranslations:
+            if originalText:
+                self.replacements.setdefault(originalText.lower(), translatedText)
+
+        self.manualRegex = None
+        self.regex = re.compile(self.MARKUP_PATTERN)
+        if self.replacements:
+            manualPattern = rf'(?i:\b["\'()]?(?P<phrase>{_phrase_trie_pattern(self.replacements)})[.,!?()]?["\']?\b)'
+            self.manualRegex = re.compile(manualPattern)
+            self.regex = re.compile(f"{self.MARKUP_PATTERN}|{manualPattern}")
+
+    def __call__(self, text: str, protected=None) -> str:
+        """Processes one translated text
+
+        Parameters
+        ----------
+        text: str
+            The text returned by DeepL
+        protected: list
+            The phrases replaced by placeholders in the sent text, see `add_notranslate_placeholders`
+        """
+        text = html.unescape(text)
+
+        def replace_manual(match):
+            return self.replacements[match.group("phrase").lower()]
+
+        def replace(match):
+            if match.group("tag") is not None:
+                return ""
+            if match.group("placeholder") is not None:
+                i = int(match.group("id"))
+                phrase = protected[i] if protected and i < len(protected) else ""
+                return self.manualRegex.sub(replace_manual, phrase) if self.manualRegex is not None else phrase
+            return replace_manual(match)
+
+        return self.regex.sub(replace, text)
+
+
+def response_processor_for_language(langcode) -> ResponseProcessor:
+    """
+    Returns the compiled `ResponseProcessor` of a language, it is only rebuilt when the manual translations file changes
+
+    Parameters
+    ----------
+    langcode: str
+        The language code of the translations
+    """
+    return SSML_CONFIG.derived(
+        ("response_processor", langcode),
+        ("manual_translations",),
+        lambda: ResponseProcessor(
+            [
+                (row["Original Text"], row["Translated Text"])
+                for row in SSML_CONFIG.get("manual_translations")
+                if row["Language Code"] == langcode
+            ]
+        ),
+    )
+
+
+def process_response_text(text, targetLanguage, protected=None) -> Any:
     """
-    This function processes the text returned from the API response
+    This function processes the text returned from the API response: html entities are unescaped, notranslate tags removed, placeholders restored and manual translations substituted. See `ResponseProcessor`
 
     Parameters
     ----------
@@ -534,6 +642,8 @@ def process_response_text(text, targetLanguage) -> Any:
         The text to process
     targetLanguage: str
         The language code of the text. For example, if the text is in English, the langcode is 'en'
+    protected: list
+        The phrases replaced by placeholders in the sent text, see `add_notranslate_placeholders`
 
     Returns
     -------
@@ -541,7 +651,4 @@ def process_response_text(text, targetLanguage) -> Any:
         The processed text
 
     """
-    text = html.unescape(text)
-    text = remove_notranslate_tags(text)
-    text = replace_manual_translations(text, targetLanguage)
-    return text
+    return response_processor_for_language(targetLanguage)(text, protected)
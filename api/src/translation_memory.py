@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from sys import stdout
+from typing import Optional
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=stdout,
+)
+
+# SQLite file of the translation memory, set to an empty string to disable it
+TRANSLATION_MEMORY_PATH = os.environ.get(
+    "TRANSLATION_MEMORY_PATH",
+    os.path.join(tempfile.gettempdir(), "auto-dub-translation-memory.sqlite3"),
+)
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", "500000"))
+TRANSLATION_MEMORY_MAX_BYTES = int(os.environ.get("TRANSLATION_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# SQLite limits the number of parameters of a statement
+_SQL_BATCH = 500
+
+
+def translation_key(text: str, target_lang: str, formality: str, glossary_version: str) -> str:
+    """The content address of a translation. `text` is the source text after tagging"""
+    raw = f"{target_lang}\x1f{formality}\x1f{glossary_version}\x1f{text}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TranslationMemory:
+    """
+    A persistent cache of DeepL translations, keyed by `translation_key`. Entries are evicted least recently used first once the memory holds more than `max_entries` entries or `max_bytes` bytes of text.
+
+    Parameters
+    ----------
+    path: str
+        the SQLite file, created if it does not exist
+    max_entries: int
+        maximum number of stored translations
+    max_bytes: int
+        maximum total size of the stored source and translated texts, in utf-8 bytes
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = TRANSLATION_MEMORY_MAX_ENTRIES,
+        max_bytes: int = TRANSLATION_MEMORY_MAX_BYTES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+
+        # Running totals of the table, kept by triggers so a store never has to scan the table
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations_totals ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS translations_totals_insert AFTER INSERT ON translations BEGIN "
+                "UPDATE translations_totals SET entries = entries + 1, bytes = bytes + new.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS translations_totals_delete AFTER DELETE ON translations BEGIN "
+                "UPDATE translations_totals SET entries = entries - 1, bytes = bytes - old.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS translations_totals_update AFTER UPDATE OF size ON translations BEGIN "
+                "UPDATE translations_totals SET bytes = bytes - old.size + new.size; END"
+            )
+            # A file written before the totals existed is counted once
+            self._conn.execute(
+                "INSERT OR IGNORE INTO translations_totals (id, entries, bytes) "
+                "SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM translations"
+            )
+            self._conn.execute("COMMIT")
+        except sqlite3.Error:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def get_many(self, keys: list) -> dict:
+        """Looks up translations by key and marks the hits as recently used
+
+        Returns
+        -------
+        dict
+            {key: translation} of the keys found
+        """
+        found: dict = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for x in range(0, len(unique), _SQL_BATCH):
+                batch = unique[x : x + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, translation FROM translations WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        return found
+
+    def put_many(self, entries: dict, source_sizes: Optional[dict] = None) -> None:
+        """Stores translations, then evicts the least recently used ones over the limits
+
+        Parameters
+        ----------
+        entries: dict
+            {key: translation}
+        source_sizes: dict
+            {key: utf-8 size of the source text}, counted towards `max_bytes`
+        """
+        if not entries:
+            return
+        source_sizes = source_sizes or {}
+        now = time.time()
+        rows = [
+            (key, translation, len(translation.encode("utf-8")) + source_sizes.get(key, 0), now)
+            for key, translation in entries.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                # An upsert instead of INSERT OR REPLACE, the replaced row would not fire the delete trigger
+                self._conn.executemany(
+                    "INSERT INTO translations (key, translation, size, last_used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET "
+                    "translation = excluded.translation, size = excluded.size, last_used = excluded.last_used",
+                    rows,
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        count, size = self._conn.execute("SELECT entries, bytes FROM translations_totals").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+
+        # Walk the entries from least recently used until both limits are met
+        evict = []
+        for key, entrySize in self._conn.execute(
+            "SELECT key, size FROM translations ORDER BY last_used"
+        ):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            evict.append((key,))
+            count -= 1
+            size -= entrySize
+        self._conn.executemany("DELETE FROM translations WHERE key = ?", evict)
+        logging.debug(f"TRANSLATION MEMORY EVICTED: {len(evict)}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT entries FROM translations_totals").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_memory: Optional[TranslationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_translation_memory() -> Optional[TranslationMemory]:
+    """Returns the translation memory shared by this process, None if it is disabled or cannot be opened"""
+    global _memory
+    if not TRANSLATION_MEMORY_PATH:
+        return None
+    with _memory_lock:
+        if _memory == None:
+            try:
+                _memory = TranslationMemory(TRANSLATION_MEMORY_PATH)
+            except Exception as e:
+                logging.debug(f"COULD NOT OPEN TRANSLATION MEMORY: {e}")
+                return None
+        return _memory
@@ -5,7 +5,11 @@ from sys import stdout
 from unicodedata import name
 
 from api_auth import USER_AUTH
+from firebase_admin import firestore
 from settings import Order
+from subtitles import TRACK_ARTIFACT_VERSION
+from subtitle_writer import SUBTITLE_FORMATS, upload_subtitles
+from timing import timed
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -85,6 +89,183 @@ class USER:
         except:
             raise Exception("Error setting order settings")
 
+    def get_order(self, order_id):
+        """Gets an order of the user from db
+
+        Parameters
+            order_id (str):
+                order id
+
+        Returns
+            dict | None:
+                order info, None if the order does not exist
+        """
+        snapshot = self.db.collection("orders").document(order_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def download_json(self, path):
+        """Downloads and parses a json file from storage
+
+        Parameters
+            path (str):
+                path to file in storage
+
+        Returns
+            Any:
+                the parsed json
+
+        Raises
+            Exception:
+                Invalid path, must start with user id
+        """
+        if path.split("/")[0] != self.user.uid:
+            raise Exception("Invalid path, must start with user id")
+        return json.loads(self.bucket.blob(path).download_as_bytes())
+
+    def get_blob_metadata(self, path):
+        """Gets the storage metadata of a file, without downloading it
+
+        Parameters
+            path (str):
+                path to file in storage
+
+        Returns
+            google.cloud.storage.Blob | None:
+                the blob with md5_hash, generation and metadata loaded, None if the file does not exist
+
+        Raises
+            Exception:
+                Invalid path, must start with user id
+        """
+        if path.split("/")[0] != self.user.uid:
+            raise Exception("Invalid path, must start with user id")
+        return self.bucket.get_blob(path)
+
+    def download_track_artifact(self, path, source_md5, source_generation):
+        """Downloads a parsed track artifact if it was built from the given version of its srt file, in the current artifact format
+
+        Parameters
+            path (str):
+                path to the artifact in storage, see `track_cache.track_artifact_path`
+            source_md5 (str):
+                md5 of the current srt file
+            source_generation (int):
+                generation of the current srt file
+
+        Returns
+            bytes | None:
+                the artifact, None if it does not exist or is stale
+        """
+        blob = self.get_blob_metadata(path)
+        if blob == None:
+            return None
+        metadata = blob.metadata or {}
+        if (
+            metadata.get("source_md5") != source_md5
+            or metadata.get("source_generation") != str(source_generation)
+            or metadata.get("artifact_version") != str(TRACK_ARTIFACT_VERSION)
+        ):
+            logging.debug(f"STALE TRACK ARTIFACT: {path}")
+            return None
+        return blob.download_as_bytes()
+
+    @timed()
+    def upload_track_artifact(self, path, data, source_md5, source_generation):
+        """Uploads a parsed track artifact next to its srt file
+
+        Parameters
+            path (str):
+                path to the artifact in storage, see `track_cache.track_artifact_path`
+            data (bytes):
+                the serialized track, see `SubtitleTrack.to_bytes`
+            source_md5 (str):
+                md5 of the srt file the track was parsed from
+            source_generation (int):
+                generation of the srt file the track was parsed from
+
+        Raises
+            Exception:
+                Error uploading file to storage
+        """
+        if path.split("/")[0] != self.user.uid:
+            raise Exception("Invalid path, must start with user id")
+        try:
+            blob = self.bucket.blob(path)
+            blob.metadata = {
+                "source_md5": source_md5,
+                "source_generation": str(source_generation),
+                "artifact_version": str(TRACK_ARTIFACT_VERSION),
+            }
+            blob.upload_from_string(data, content_type="application/octet-stream")
+            logging.debug("TRACK ARTIFACT UPLOADED")
+        except:
+            raise Exception("Error uploading file to storage")
+
+        return True
+
+    def set_order_timings(self, timings):
+        """Stores the per stage durations of the order in db
+
+        Parameters
+            timings (dict):
+                {stage: {"ms": float, "count": int}}, see `timing.Timings.summary`
+
+        Raises
+            Exception: No order info set
+            Exception: Error updating order
+        """
+        if self.order_ref == None:
+            raise Exception("No order info set")
+        try:
+            self.order_ref.set({"timings": timings}, merge=True)
+            logging.debug("ORDER UPDATED")
+        except:
+            raise Exception("Error updating order")
+
+        return True
+
+    def get_voice_rate_model(self, voice_key):
+        """Gets the speaking rate statistics of a voice from db
+
+        Parameters
+            voice_key (str):
+                voice id, see `voice_rate_model.voice_model_key`
+
+        Returns
+            dict | None:
+                the sufficient statistics of the voice, see `voice_rate_model.VoiceRateModel`. None if the voice was never synthesized
+        """
+        try:
+            snapshot = self.db.collection("voice_rate_models").document(voice_key).get()
+        except:
+            logging.debug(f"COULD NOT GET VOICE RATE MODEL: {voice_key}")
+            return None
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def update_voice_rate_model(self, voice_key, stats):
+        """Adds the statistics of newly synthesized clips to the model of a voice in db. The fields are incremented, so orders synthesizing the same voice at the same time do not overwrite each other
+
+        Parameters
+            voice_key (str):
+                voice id, see `voice_rate_model.voice_model_key`
+            stats (dict):
+                sufficient statistics of the new clips, see `voice_rate_model.VoiceRateModel.to_dict`
+
+        Raises
+            Exception: Error updating voice rate model
+        """
+        try:
+            self.db.collection("voice_rate_models").document(voice_key).set(
+                {field: firestore.Increment(value) for field, value in stats.items()},
+                merge=True,
+            )
+            logging.debug("VOICE RATE MODEL UPDATED")
+        except:
+            raise Exception("Error updating voice rate model")
+
+        return True
+
+    @timed()
     def upload_translation(self, file, order_id, language):
         """Uploads translated order file to storage and updates order in db
 
@@ -143,7 +324,61 @@ class USER:
 
         return True
     
-    def upload_translated_audio(self, data, order_id, language):
+    @timed()
+    def upload_subtitles(self, subs_dict, order_id, language, formats=tuple(SUBTITLE_FORMATS)):
+        """Renders translated subtitles and streams them to storage, then updates order in db
+
+        Parameters
+        ----------
+            subs_dict (SubtitleTrack):
+                translated subtitle track
+            order_id (str):
+                order id
+            language (str):
+                language of translation in DEEPL format
+            formats (tuple):
+                subtitle formats to upload, any of ("srt", "vtt", "ass")
+
+        Returns
+        -------
+            bool:
+                True if successful
+
+        Raises
+        ------
+            Exception: No order info set
+            Exception: Error uploading file to storage
+            Exception: Error updating order
+        """
+        if self.order_ref == None:
+            raise Exception("No order info set")
+
+        paths = {}
+        for fmt in formats:
+            path = f"{self.user.uid}/orders/{order_id}/subtitles/{language}.{fmt}"
+            # upload to storage
+            try:
+                upload_subtitles(self.bucket.blob(path), subs_dict, fmt=fmt)
+                logging.debug(f"SUBTITLES UPLOADED: {path}")
+            except:
+                self.order_ref.set(
+                    {f"subtitles": {language: "Failed to upload to storage"}},
+                    merge=True,
+                )
+                raise Exception("Error uploading file to storage")
+            paths[fmt] = path
+
+        # update order
+        try:
+            self.order_ref.set({f"subtitles": {language: paths}}, merge=True)
+            logging.debug("ORDER UPDATED")
+        except:
+            raise Exception("Error updating order")
+
+        return True
+
+    @timed()
+    def upload_translated_audio(self, data, order_id, language, manifest=None):
         """Uploads translated order file to storage and updates order in db
         
         Parameters
@@ -154,6 +389,8 @@ class USER:
                 order id
             language (str):
                 language of translation in DEEPL format
+            manifest (dict, optional):
+                {synthesis hash: file_name} for every clip stored for the dub, uploaded as manifest.json so later orders can reuse the clips
             
         """
         if self.order_ref == None:
@@ -190,5 +427,53 @@ class USER:
                 )
                 raise Exception("Error uploading file to storage")
 
+        try:
+            if manifest is not None:
+                self.bucket.blob(f"{self.user.uid}/orders/{order_id}/dubs/{language}/manifest.json").upload_from_string(
+                    json.dumps(manifest), content_type="application/json"
+                )
+                logging.debug("MANIFEST UPLOADED")
+        except:
+            self.order_ref.set(
+                {f"dubs": {language: "Failed to upload to storage"}},
+                merge=True,
+            )
+            raise Exception("Error uploading file to storage")
+
         return True
-        
+
+    def copy_dub_clips(self, order_id, language, previous_order_id, clips) -> list:
+        """Copies clips of the previous order's dub into the dub of this order
+
+        Parameters
+        ----------
+            order_id (str):
+                order id
+            language (str):
+                language of translation in DEEPL format
+            previous_order_id (str):
+                order id the clips are copied from
+            clips (dict):
+                {file_name: previous file_name}
+
+        Returns
+        -------
+            list:
+                the file names that were copied. A clip that could not be copied, i.e. because it is missing from the previous order, is left out so it can be synthesized instead
+        """
+        copied = []
+        for file_name, previous_file_name in clips.items():
+            try:
+                self.bucket.copy_blob(
+                    self.bucket.blob(
+                        f"{self.user.uid}/orders/{previous_order_id}/dubs/{language}/{previous_file_name}"
+                    ),
+                    self.bucket,
+                    f"{self.user.uid}/orders/{order_id}/dubs/{language}/{file_name}",
+                )
+                copied.append(file_name)
+            except Exception as e:
+                logging.warning(f"COULD NOT COPY CLIP {previous_file_name} FROM ORDER {previous_order_id}: {e}")
+        logging.debug(f"CLIPS COPIED: {len(copied)} of {len(clips)}")
+        return copied
+
@@ -1,12 +1,13 @@
 import csv
 import logging
 import pathlib
-import re
-from msilib import type_string
 from sys import stdout
 
 import requests
 
+from subtitle_writer import write_subtitles
+from subtitles import SubtitleTrack
+
 logging.basicConfig(
     level=logging.DEBUG,
     format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
@@ -45,168 +46,66 @@ def download_srt_file(url: str, file_dest: str) -> pathlib.Path:
     return pathlib.Path(file_dest)
 
 
-def srt_to_dict(lines, addBufferMilliseconds) -> dict:
+def srt_to_dict(lines, addBufferMilliseconds) -> SubtitleTrack:
     """
-    Takes a list of lines from an srt file and returns a dictionary
+    Takes the lines of an srt file and returns a subtitle track. The track is a dict compatible mapping, so it can be used like the dictionary below
 
     Parameters
     ----------
-    lines : list
-        list of lines from an srt file
+    lines : Iterable[str | bytes]
+        lines from an srt file. Any iterable works, the lines are parsed in a single pass
     addBufferMilliseconds : int
         number of milliseconds to add to the start and end of each srt line
 
     Returns
     -------
-    dict
+    SubtitleTrack
         with the following structure:
         {
         key: str
             the srt line Number
         value: dict
             {
-                'start_ms': str
+                'start_ms': int
                     start time in milliseconds,
-                'end_ms': str
+                'end_ms': int
                     end time in milliseconds,
-                'duration_ms': str
+                'duration_ms': int
                     duration in milliseconds,
                 'text': str
                     the text of the subtitle,
                 'break_until_next': int
-                    number of milliseconds until the next subtitle,
+                    number of milliseconds until the next subtitle [0 for the last subtitle],
                 'srt_timestamps_line': str
                     the srt formatted timestamps i.e. '00:00:03,400 --> 00:00:06,177',
-                'start_ms_buffered': str
+                'start_ms_buffered': int
                     start time in milliseconds with buffer [if buffer = 0 this is the same as start_ms],
                 'end_ms_buffered': int
                     end time in milliseconds with buffer [if buffer = 0 this is the same as end_ms],
-                'duration_ms_buffered': str
+                'duration_ms_buffered': int
                     duration of srt line in milliseconds with buffer [if buffer = 0 this is the same as duration_ms]
             }
         }
     """
-    # Matches the following example with regex:    00:00:20,130 --> 00:00:23,419
-    subtitleTimeLineRegex = re.compile(
-        r"\d:\d\d:\d\d,\d\d\d --> \d:\d\d:\d\d,\d\d\d"
-    ) or re.compile(r"\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d")
-
-    # Create a dictionary
-    subsDict = {}
-
-    # Enumerate lines, and if a line in lines contains only an integer, put that number in the key, and a dictionary in the value
-    # The dictionary contains the start, ending, and duration of the subtitles as well as the text
-    # The next line uses the syntax HH:MM:SS,MMM --> HH:MM:SS,MMM . Get the difference between the two times and put that in the dictionary
-    # For the line after that, put the text in the dictionary
-    logging.debug(f"ENUMERATING LINES")
-    for lineNum, line in enumerate(lines):
-        
-        line = line.strip()
-        if line.isdigit() and subtitleTimeLineRegex.match(lines[lineNum + 1]):
-            lineWithTimestamps = lines[lineNum + 1].strip()
-            lineWithSubtitleText = lines[lineNum + 2].strip()
-
-            # If there are more lines after the subtitle text, add them to the text
-            count = 3
-            while True:
-                # Check if the next line is blank or not
-                if (lineNum + count) < len(lines) and lines[lineNum + count].strip():
-                    lineWithSubtitleText += " " + lines[lineNum + count].strip()
-                    count += 1
-                else:
-                    break
-            logging.debug(f"SUBTITLE TEXT MERGED")
-            # Create empty dictionary with keys for start and end times and subtitle text
-            subsDict[line] = {
-                "start_ms": "",
-                "end_ms": "",
-                "duration_ms": "",
-                "text": "",
-                "break_until_next": "",
-                "srt_timestamps_line": lineWithTimestamps,
-            }
+    subsTrack = SubtitleTrack.from_srt(lines, addBufferMilliseconds)
+
+    logging.debug(f"SUBTITLE TRACK CREATED. CUES: {len(subsTrack)}")
 
-            time = lineWithTimestamps.split(" --> ")
-            time1 = time[0].split(":")
-            time2 = time[1].split(":")
-
-            # Converts the time to milliseconds
-            processedTime1 = (
-                int(time1[0]) * 3600000
-                + int(time1[1]) * 60000
-                + int(time1[2].split(",")[0]) * 1000
-                + int(time1[2].split(",")[1])
-            )  # / 1000 #Uncomment to turn into seconds
-            processedTime2 = (
-                int(time2[0]) * 3600000
-                + int(time2[1]) * 60000
-                + int(time2[2].split(",")[0]) * 1000
-                + int(time2[2].split(",")[1])
-            )  # / 1000 #Uncomment to turn into seconds
-            timeDifferenceMs = str(processedTime2 - processedTime1)
-
-            logging.debug(f"TIME DIFFERENCE CALCULATED")
-
-            # Adjust times with buffer
-            if addBufferMilliseconds > 0:
-                subsDict[line]["start_ms_buffered"] = str(
-                    processedTime1 + addBufferMilliseconds
-                )
-                subsDict[line]["end_ms_buffered"] = str(
-                    processedTime2 - addBufferMilliseconds
-                )
-                subsDict[line]["duration_ms_buffered"] = str(
-                    (processedTime2 - addBufferMilliseconds)
-                    - (processedTime1 + addBufferMilliseconds)
-                )
-            else:
-                subsDict[line]["start_ms_buffered"] = str(processedTime1)
-                subsDict[line]["end_ms_buffered"] = str(processedTime2)
-                subsDict[line]["duration_ms_buffered"] = str(
-                    processedTime2 - processedTime1
-                )
-
-            # Set the keys in the dictionary to the values
-            subsDict[line]["start_ms"] = str(processedTime1)
-            subsDict[line]["end_ms"] = str(processedTime2)
-            subsDict[line]["duration_ms"] = timeDifferenceMs
-            subsDict[line]["text"] = lineWithSubtitleText
-            if lineNum > 0:
-                # Goes back to previous line's dictionary and writes difference in time to current line
-                subsDict[str(int(line) - 1)]["break_until_next"] = processedTime1 - int(
-                    subsDict[str(int(line) - 1)]["end_ms"]
-                )
-            else:
-                subsDict[line]["break_until_next"] = 0
-
-    # Apply the buffer to the start and end times by setting copying over the buffer values to main values
-    for key, value in subsDict.items():
-        if addBufferMilliseconds > 0:
-            subsDict[key]["start_ms"] = value["start_ms_buffered"]
-            subsDict[key]["end_ms"] = value["end_ms_buffered"]
-            subsDict[key]["duration_ms"] = value["duration_ms_buffered"]
-
-    logging.debug(f"SUBTITLES DICTIONARY CREATED")
-
-    return subsDict
+    return subsTrack
 
 
 def tanslated_srt_to_file(subs_dict, dst):
-    """Writes a translated subtitle dictionary to a subtitle file.
+    """Writes a translated subtitle dictionary to a subtitle file. See `subtitle_writer` for other formats.
 
     Parameters
     ----------
-    subs_dict: dict
-        A dictionary containing subtitle information.
+    subs_dict: SubtitleTrack | dict
+        A track or dictionary containing subtitle information.
     dst: str
         The destination file path.
 
     """
-    with open(dst, "w", encoding="utf-8-sig") as f:
-        for key in subs_dict:
-            f.write(str(key) + "\n")
-            f.write(subs_dict[key]["srt_timestamps_line"] + "\n")
-            f.write(subs_dict[key]["translated_text"] + "\n\n")
+    write_subtitles(subs_dict, dst, fmt="srt")
 
 
 def get_duration(filename) -> int:
@@ -0,0 +1,193 @@
+import logging
+import os
+from sys import stdout
+from typing import Literal, Optional, Union
+
+import numpy as np
+
+from timing_planner import MAX_SPEED_FACTOR, MIN_SPEED_FACTOR, plan_timing
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=stdout,
+)
+
+# Observations needed before a voice's predictions are trusted, below it every cue is synthesized once at the default rate
+VOICE_RATE_MIN_OBSERVATIONS = int(os.environ.get("VOICE_RATE_MIN_OBSERVATIONS", "30"))
+# Allowed relative error of a clip's length, a cue whose prediction may miss by more is synthesized twice
+SPEED_FIT_TOLERANCE = float(os.environ.get("SPEED_FIT_TOLERANCE", "0.1"))
+# The second pass is billed by Azure like the first one. dubs only runs it when this is "True" and the order has `two_pass_voice_synth`, otherwise every clip is synthesized once like before the model
+VOICE_RATE_SECOND_PASS = os.environ.get("VOICE_RATE_SECOND_PASS") == "True"
+# Two sided 90% interval of the prediction
+PREDICTION_Z = 1.645
+
+
+def voice_model_key(lang_dict, azure_sentence_pause: Union[Literal["default"], int] = "default") -> str:
+    """The id of the model of a voice, everything that changes how fast the voice speaks at the default rate. Used as a db document id"""
+    return f"{lang_dict['synth_language_code']}_{lang_dict['synth_voice_name']}_{azure_sentence_pause}".replace("/", "-")
+
+
+class VoiceRateModel:
+    """
+    A linear model of how long a voice takes to speak a text at the default rate: duration_ms = intercept + ms_per_char * characters, fitted by least squares from the trimmed lengths of synthesized clips.
+
+    Only the sufficient statistics of the fit are stored, so the model of a voice is updated by adding up the statistics of each order, i.e. with db increments, and never needs the individual clips.
+
+    Parameters
+    ----------
+    n: int
+        number of observed clips
+    sum_x, sum_y, sum_xx, sum_xy, sum_yy: float
+        sums of the characters (x), the default rate durations in ms (y) and their products
+    """
+
+    FIELDS = ("n", "sum_x", "sum_y", "sum_xx", "sum_xy", "sum_yy")
+
+    def __init__(self, n=0, sum_x=0.0, sum_y=0.0, sum_xx=0.0, sum_xy=0.0, sum_yy=0.0):
+        self.n = int(n)
+        self.sum_x = float(sum_x)
+        self.sum_y = float(sum_y)
+        self.sum_xx = float(sum_xx)
+        self.sum_xy = float(sum_xy)
+        self.sum_yy = float(sum_yy)
+
+    @classmethod
+    def from_dict(cls, stats: Optional[dict]) -> "VoiceRateModel":
+        stats = stats or {}
+        return cls(**{field: stats.get(field, 0) for field in cls.FIELDS})
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def merge(self, other: "VoiceRateModel") -> "VoiceRateModel":
+        return VoiceRateModel(**{field: getattr(self, field) + getattr(other, field) for field in self.FIELDS})
+
+    def observe(self, characters: int, duration_ms: float, speed_factor: float = 1.0) -> None:
+        """Adds a clip. A clip synthesized at another rate is scaled back to the default rate"""
+        if characters <= 0 or duration_ms <= 0:
+            return
+        x = float(characters)
+        y = float(duration_ms) * speed_factor
+        self.n += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+        self.sum_yy += y * y
+
+    def _centered(self) -> tuple:
+        """Returns (mean x, Sxx, Sxy, Syy)"""
+        meanX = self.sum_x / self.n
+        sxx = max(self.sum_xx - self.sum_x * meanX, 0.0)
+        sxy = self.sum_xy - self.sum_x * (self.sum_y / self.n)
+        syy = max(self.sum_yy - self.sum_y * (self.sum_y / self.n), 0.0)
+        return meanX, sxx, sxy, syy
+
+    @property
+    def ready(self) -> bool:
+        return self.n >= max(VOICE_RATE_MIN_OBSERVATIONS, 3) and self._centered()[1] > 0
+
+    @property
+    def chars_per_second(self) -> Optional[float]:
+        """The average speaking rate of the observed clips"""
+        if self.sum_y <= 0:
+            return None
+        return self.sum_x / (self.sum_y / 1000)
+
+    def predict(self, characters) -> Optional[tuple]:
+        """
+        Predicts the length of clips at the default rate
+
+        Parameters
+        ----------
+        characters: int | array like
+            the length of the texts
+
+        Returns
+        -------
+        (float, float) | (np.ndarray, np.ndarray) | None
+            the duration in ms and the standard error of the prediction, None until the model is `ready`
+        """
+        if not self.ready:
+            return None
+        meanX, sxx, sxy, syy = self._centered()
+        slope = sxy / sxx
+        intercept = self.sum_y / self.n - slope * meanX
+        residualVariance = max(syy - slope * sxy, 0.0) / (self.n - 2)
+        x = np.asarray(characters, dtype=np.float64)
+        se = np.sqrt(residualVariance * (1 + 1 / self.n + (x - meanX) ** 2 / sxx))
+        if x.ndim == 0:
+            return intercept + slope * float(x), float(se)
+        return intercept + slope * x, se
+
+
+def predict_speed_factors(
+    subs_dict: dict,
+    model: VoiceRateModel,
+    tolerance: float = SPEED_FIT_TOLERANCE,
+    max_overflow_ms: int = 0,
+) -> int:
+    """
+    Sets the `speed_factor` of every cue to the one predicted to make its clip fit, see `timing_planner.plan_timing`, `overflow_ms` to the silence after the cue its clip may use, `speed_factor_predicted` to whether the model made a prediction, and `speed_factor_uncertain` to whether the clip may still miss by more than `tolerance` and needs the second pass.
+
+    While the model is not ready nothing is predicted, the cues are left at the default rate and are not marked uncertain, so they are synthesized once like before the model. Their clips still become observations of the model.
+
+    Returns
+    -------
+    int
+        number of uncertain cues
+    """
+    values = list(subs_dict.values())
+    characters = np.fromiter((len(value["translated_text"]) for value in values), dtype=np.float64, count=len(values))
+    prediction = model.predict(characters)
+
+    if prediction is None:
+        for value in values:
+            value["speed_factor"] = 1.0
+            value["speed_factor_predicted"] = False
+            value["speed_factor_uncertain"] = False
+            value["overflow_ms"] = 0
+        logging.debug(f"VOICE RATE MODEL NOT READY, {model.n} OF {VOICE_RATE_MIN_OBSERVATIONS} OBSERVATIONS")
+        return 0
+
+    predictedMs, se = prediction
+    plan = plan_timing(subs_dict, np.maximum(predictedMs, 0), max_overflow_ms)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        uncertain = (characters == 0) | (predictedMs <= 0) | (PREDICTION_Z * se / predictedMs > tolerance)
+    # Rounded to 1% so small changes of the model do not change the synthesis hash of a clip
+    speedFactors = np.where((characters == 0) | (predictedMs <= 0), 1.0, np.round(plan.speed_factor, 2))
+
+    for value, speedFactor, isUncertain, overflow in zip(
+        values, speedFactors.tolist(), uncertain.tolist(), plan.overflow_ms.tolist()
+    ):
+        value["speed_factor"] = speedFactor
+        value["speed_factor_predicted"] = True
+        value["speed_factor_uncertain"] = isUncertain
+        value["overflow_ms"] = overflow
+
+    logging.debug(f"UNCERTAIN SPEED FACTORS: {int(uncertain.sum())} of {len(values)}")
+    return int(uncertain.sum())
+
+
+def corrected_speed_factor(
+    duration_ms: float,
+    clip_ms: float,
+    speed_factor: float,
+    tolerance: float = SPEED_FIT_TOLERANCE,
+    overflow_ms: int = 0,
+) -> Optional[float]:
+    """Returns the speed factor to resynthesize a clip with so it fits `duration_ms`, plus up to `overflow_ms` of the silence after it. None if the clip already fits within `tolerance` or cannot be fixed by the rate"""
+    if duration_ms <= 0 or clip_ms <= 0:
+        return None
+    if clip_ms < duration_ms * (1 - tolerance):
+        target = duration_ms
+    elif clip_ms > duration_ms * (1 + tolerance) + overflow_ms:
+        target = duration_ms + overflow_ms
+    else:
+        return None
+    corrected = round(min(max(speed_factor * clip_ms / target, MIN_SPEED_FACTOR), MAX_SPEED_FACTOR), 2)
+    if corrected == round(speed_factor, 2):
+        return None
+    return corrected
@@ -1,33 +1,28 @@
 import copy
 import datetime
+import hashlib
 import io
 import json
-import os
+import logging
 import re
 import time
 import zipfile
 from typing import Any
 from pydub import AudioSegment
 from pydub.silence import detect_leading_silence
-from typing import Literal, Union
+from typing import Literal, Tuple, Union
 from urllib.request import urlopen
 
 import azure_batch
-from utils import csv_to_dict, parseBool, txt_to_list
-
-interpretAsOverrideFile = os.path.abspath("SSML_Customization/interpret-as.csv")
-interpretAsEntries = csv_to_dict(interpretAsOverrideFile)
-urlListFile = os.path.abspath("SSML_Customization/url_list.txt")
-urlList = txt_to_list(urlListFile)
-aliasOverrideFile = os.path.abspath("SSML_Customization/aliases.csv")
-aliasEntries = csv_to_dict(aliasOverrideFile)
-phonemeFile = os.path.abspath("SSML_Customization/Phoneme_Pronunciation.csv")
-phonemeEntries = csv_to_dict(phonemeFile)
-
+from ssml_config import SSML_CONFIG
+from subtitles import SubtitleTrack
+from timing import timed
+from utils import parseBool
+from voice_rate_model import VoiceRateModel, corrected_speed_factor
 
 def add_interpretas_tags(text):
     # Add interpret-as tags from interpret-as.csv
-    for entryDict in interpretAsEntries:
+    for entryDict in SSML_CONFIG.get("interpret_as"):
         # Get entry info
         entryText = entryDict["Text"]
         entryInterpretAsType = entryDict["interpret-as Type"]
@@ -53,7 +48,7 @@ def add_interpretas_tags(text):
             )
 
     # Add interpret-as tags from url_list.txt
-    for url in urlList:
+    for url in SSML_CONFIG.get("url_list"):
         # This regex expression will match the top level domain extension, and the punctuation before/after it, and any periods, slashes or colons
         # It will then put the say-as characters tag around all matches
         punctuationRegex = re.compile(r"((?:\.[a-z]{2,6}(?:\/|$|\s))|(?:[\.\/:]+))")
@@ -67,7 +62,7 @@ def add_interpretas_tags(text):
 
 
 def add_alias_tags(text):
-    for entryDict in aliasEntries:
+    for entryDict in SSML_CONFIG.get("aliases"):
         # Get entry info
         entryText = entryDict["Original Text"]
         entryAlias = entryDict["Alias"]
@@ -87,7 +82,7 @@ def add_alias_tags(text):
 
 # Uses the phoneme pronunciation file to add phoneme tags to the text
 def add_phoneme_tags(text):
-    for entryDict in phonemeEntries:
+    for entryDict in SSML_CONFIG.get("phonemes"):
         # Get entry info
         entryText = entryDict["Text"]
         entryPhoneme = entryDict["Phonetic Pronunciation"]
@@ -137,6 +132,20 @@ def format_percentage_change(speedFactor):
         rate = percentSign + str(round((speedFactor - 1.0) * 100, 5)) + "%"
     return rate
 
+def synthesis_hashes(subs_dict, lang_dict, azure_sentence_pause: Union[Literal["default"], int] = "default") -> list:
+    """Returns a hash of everything that determines the synthesized clip of each subtitle, in the order of subs_dict. Clips with the same hash can be reused between orders
+
+    The speed factor is not hashed. It is predicted by the voice's rate model, which changes with every order, and the second pass may replace it. Instead the hash covers what the rate is planned from, the text, the voice, the cue's duration and the silence its clip may use, so a stored clip fits any cue with the same hash
+    """
+    voice = f"{lang_dict['synth_language_code']}\x1f{lang_dict['synth_voice_name']}\x1f{azure_sentence_pause}"
+    return [
+        hashlib.blake2b(
+            f"{voice}\x1f{int(value['duration_ms'])}\x1f{int(value.get('overflow_ms', 0))}\x1f{value['translated_text']}".encode("utf-8"),
+            digest_size=8,
+        ).hexdigest()
+        for value in subs_dict.values()
+    ]
+
 def trim_clip(inputSound):
     trim_leading_silence: AudioSegment = lambda x: x[detect_leading_silence(x) :]   #type: ignore
     trim_trailing_silence: AudioSegment = lambda x: trim_leading_silence(x.reverse()).reverse() #type: ignore
@@ -144,6 +153,10 @@ def trim_clip(inputSound):
     strippedSound = strip_silence(inputSound)   #type: ignore
     return strippedSound
 
+def clip_duration_ms(data: bytes) -> int:
+    """The length of a synthesized mp3 clip without its leading and trailing silence, like the clips are inserted by `build_audio`"""
+    return len(trim_clip(AudioSegment.from_file(io.BytesIO(data), format="mp3")))
+
 def create_canvas(canvasDuration, frame_rate):
     canvas = AudioSegment.silent(duration=canvasDuration, frame_rate=frame_rate)
     return canvas
@@ -156,15 +169,16 @@ def insert_audio(canvas, audioToOverlay, startTimeMs):
     # Return the copy
     return canvasCopy
 
-def build_audio(subs_dict: dict, lang_dict, total_audio_length, two_pass_voice_synth=False, native_sample_rate=44100, skipSynthesize=False):
+def build_audio(subs_dict: SubtitleTrack, lang_dict, total_audio_length, two_pass_voice_synth=False, native_sample_rate=44100, skipSynthesize=False):
     """Builds the final audio file from the subs_dict and the audio files in the temp folder
     !!!!!!!!!!!!!!!!!!!!!!!!!!
     BROKEN - NEEDS TO BE FIXED
     !!!!!!!!!!!!!!!!!!!!!!!!!!
     """
+    subs_dict = SubtitleTrack.from_dict(subs_dict)
     virtual_trimmed_file_dict = {}
     # First trim silence off the audio files
-    for key, value in subs_dict.items():
+    for key_index, (key, value) in enumerate(subs_dict.items()):
 
         # Trim the clip and re-write file
         raw_clip = AudioSegment.from_file(value['TTS_FilePath'], format="mp3", frame_rate=native_sample_rate)
@@ -174,31 +188,28 @@ def build_audio(subs_dict: dict, lang_dict, total_audio_length, two_pass_voice_s
         temp_trimmed_file = io.BytesIO()
         trimmed_clip.export(temp_trimmed_file, format="wav")
         virtual_trimmed_file_dict[key] = temp_trimmed_file
-        key_index = list(subs_dict.keys()).index(key)
         print(f" Trimmed Audio: {key_index+1} of {len(subs_dict)}", end="\r")
 
     if two_pass_voice_synth == True:
         _ , subs_dict = synthesize_text_azure_batch(subs_dict, lang_dict, second_pass=True)
             
-        for key, value in subs_dict.items():
+        for key_index, (key, value) in enumerate(subs_dict.items()):
             # Trim the clip and re-write file
             raw_clip = AudioSegment.from_file(value['TTS_FilePath'], format="mp3", frame_rate=native_sample_rate)
             trimmed_clip = trim_clip(raw_clip)
 
             trimmed_clip.export(virtual_trimmed_file_dict[key], format="wav")
-            key_index = list(subs_dict.keys()).index(key)
             print(f" Trimmed Audio (2nd Pass): {key_index+1} of {len(subs_dict)}", end="\r")
         # Create canvas to overlay audio onto
     
     canvas = create_canvas(total_audio_length, native_sample_rate)
 
     # Stretch audio and insert into canvas
-    for key, value in subs_dict.items():
+    for key_index, (key, start_ms) in enumerate(zip(subs_dict, subs_dict.start_ms.tolist())):
         stretched_clip = AudioSegment.from_file(virtual_trimmed_file_dict[key], format="wav")
         virtual_trimmed_file_dict[key].seek(0) # Not 100% sure if this is necessary but it was in the other place it is used
 
-        canvas = insert_audio(canvas, stretched_clip, value['start_ms'])
-        key_index = list(subs_dict.keys()).index(key)
+        canvas = insert_audio(canvas, stretched_clip, start_ms)
         print(f" Final Audio Processed: {key_index+1} of {len(subs_dict)}", end="\r")
     print("\n")
 
@@ -209,6 +220,7 @@ def build_audio(subs_dict: dict, lang_dict, total_audio_length, two_pass_voice_s
 
     return subs_dict
 
+@timed()
 def synthesize_text_azure_batch(
     subs_dict: dict,
     lang_dict,
@@ -228,7 +240,8 @@ def synthesize_text_azure_batch(
     """
     # Write speed factor to subs_dict in correct format
     for key, value in subs_dict.items():
-        if second_pass:
+        # A speed factor predicted by the voice rate model is already used on the first pass
+        if second_pass or isinstance(value.get("speed_factor"), float):
             subs_dict[key]["speed_factor"] = format_percentage_change(
                 subs_dict[key]["speed_factor"]
             )
@@ -408,3 +421,62 @@ def synthesize_text_azure_batch(
                         remainingDownloadedEntriesList.pop(0)
 
                 return upload_files, subs_dict
+
+
+@timed()
+def synthesize_with_rate_model(
+    subs_dict: dict,
+    lang_dict,
+    two_pass_voice_synth=False,
+    azure_sentence_pause: Union[Literal["default"], int] = "default",
+) -> Tuple[dict, VoiceRateModel]:
+    """
+    Synthesizes the cues at the speed factors predicted by `voice_rate_model.predict_speed_factors`, then measures the clips. With `two_pass_voice_synth` only the clips of cues whose prediction was uncertain and that missed their duration are synthesized again, at a corrected rate. Cues without a prediction, while the voice's model is not ready, are synthesized once.
+
+    Returns
+    -------
+    (dict, VoiceRateModel)
+        the audio files {file name: bytes} like `synthesize_text_azure_batch`, and the statistics of the measured first pass clips to add to the voice's model
+    """
+    # synthesize_text_azure_batch replaces the factors with Azure rate strings
+    speedFactors = {
+        key: value["speed_factor"] if isinstance(value.get("speed_factor"), float) else 1.0
+        for key, value in subs_dict.items()
+    }
+    upload_files, subs_dict = synthesize_text_azure_batch(
+        subs_dict=subs_dict,
+        lang_dict=lang_dict,
+        second_pass=False,
+        azure_sentence_pause=azure_sentence_pause,
+    )
+
+    observed = VoiceRateModel()
+    second_pass = {}
+    for key, value in subs_dict.items():
+        data = upload_files.get(f"{key}.mp3")
+        if data is None:
+            continue
+        clipMs = clip_duration_ms(data)
+        observed.observe(len(value["translated_text"]), clipMs, speedFactors[key])
+
+        if two_pass_voice_synth and value.get("speed_factor_predicted") and value.get("speed_factor_uncertain"):
+            corrected = corrected_speed_factor(
+                int(value["duration_ms"]), clipMs, speedFactors[key], overflow_ms=value.get("overflow_ms", 0)
+            )
+            if corrected is not None:
+                value["speed_factor"] = corrected
+                second_pass[key] = value
+
+    logging.debug(f"SECOND PASS CLIPS: {len(second_pass)} of {len(subs_dict)}")
+    if second_pass:
+        second_pass_files, _ = synthesize_text_azure_batch(
+            subs_dict=second_pass,
+            lang_dict=lang_dict,
+            second_pass=True,
+            azure_sentence_pause=azure_sentence_pause,
+        )
+        upload_files.update(
+            {name: data for name, data in second_pass_files.items() if name != "summary.json"}
+        )
+
+    return upload_files, observed